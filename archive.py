@@ -0,0 +1,265 @@
+import gzip
+import io
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import wait
+from typing import Callable, Optional, Tuple
+
+from context import estimate_tokens
+from db import configure_connection, utc_now_iso
+
+# Export formats. NDJSON holds one message per line; the archive is the same
+# NDJSON gzip-compressed, with a header line so it can be recognised on
+# import. JSON (one array) and TXT are for reading only.
+FORMATS = {
+    "ndjson": ".ndjson",
+    "archive": ".ndjson.gz",
+    "json": ".json",
+    "txt": ".txt",
+}
+
+ARCHIVE_HEADER = {"format": "localai-chat-archive", "version": 1}
+
+PROGRESS_EVERY = 1000
+
+Progress = Optional[Callable[[int, int], None]]
+
+
+class Cancelled(Exception):
+    pass
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # Export runs on a worker thread with a read connection of its own; WAL
+    # lets the UI keep reading and writing meanwhile.
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    configure_connection(conn)
+    return conn
+
+
+def _open_output(path: str, fmt: str):
+    if fmt == "archive":
+        return io.TextIOWrapper(gzip.open(path, "wb", compresslevel=6), encoding="utf-8", newline="\n")
+    return open(path, "w", encoding="utf-8", newline="\n")
+
+
+def _text_reader(raw):
+    # Archives are recognised by the gzip magic number, not the file name.
+    compressed = raw.peek(2)[:2] == b"\x1f\x8b"
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=raw) if compressed else raw, encoding="utf-8")
+
+
+def count_messages(conn: sqlite3.Connection, session_id: Optional[str] = None) -> int:
+    if session_id is None:
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+
+def _sessions(conn: sqlite3.Connection, session_id: Optional[str]):
+    if session_id is None:
+        return conn.execute("SELECT id, created_at FROM sessions ORDER BY rowid")
+    return conn.execute("SELECT id, created_at FROM sessions WHERE id = ?", (session_id,))
+
+
+def export_messages(db_path: str, path: str, fmt: str = "ndjson", session_id: Optional[str] = None,
+                    progress: Progress = None, stop: Optional[threading.Event] = None) -> int:
+    # Streams one session (or every session) from cursors straight to disk,
+    # so memory stays flat however large the history is. The file is
+    # written under a temporary name and only renamed into place once
+    # complete. Returns the number of messages written.
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    conn = _connect(db_path)
+    tmp = path + ".part"
+    written = 0
+    try:
+        total = count_messages(conn, session_id)
+        with _open_output(tmp, fmt) as out:
+            if fmt == "archive":
+                out.write(json.dumps(dict(ARCHIVE_HEADER, exported_at=utc_now_iso())) + "\n")
+            elif fmt == "json":
+                out.write("[")
+            # A second cursor walks each session's messages through the
+            # (session_id, id) index while the first walks the sessions.
+            for session in _sessions(conn, session_id):
+                rows = conn.execute(
+                    "SELECT role, content, created_at, truncated, model FROM messages WHERE session_id = ? ORDER BY id",
+                    (session["id"],)
+                )
+                if fmt == "txt":
+                    out.write(f"=== Session {session['id']} ({session['created_at']}) ===\n\n")
+                for r in rows:
+                    if fmt == "txt":
+                        out.write(f"[{r['created_at']}] {r['role'].upper()}: {r['content']}\n\n")
+                    else:
+                        line = json.dumps({
+                            "session_id": session["id"],
+                            "session_created_at": session["created_at"],
+                            "role": r["role"],
+                            "content": r["content"],
+                            "created_at": r["created_at"],
+                            "truncated": bool(r["truncated"]),
+                            "model": r["model"],
+                        }, ensure_ascii=False)
+                        if fmt == "json":
+                            out.write(("\n  " if written == 0 else ",\n  ") + line)
+                        else:
+                            out.write(line + "\n")
+                    written += 1
+                    if written % PROGRESS_EVERY == 0:
+                        if stop is not None and stop.is_set():
+                            raise Cancelled()
+                        if progress:
+                            progress(written, total)
+            if fmt == "json":
+                out.write("\n]\n")
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        conn.close()
+    if progress:
+        progress(written, total)
+    return written
+
+
+def import_messages(db, path: str, batch_size: int = 1000, progress: Progress = None,
+                    stop: Optional[threading.Event] = None) -> Tuple[int, int]:
+    # Reads an NDJSON file or archive line by line and hands it to the
+    # database's writer thread one batch_size chunk at a time, so other
+    # writes (and the reads waiting on them) never queue behind the whole
+    # import. The next chunk is parsed while the previous one is inserted.
+    # Sessions that already exist are skipped, so importing the same file
+    # twice adds nothing, unless an earlier import of them was interrupted
+    # (see session_imports in db.py): those are emptied and imported again.
+    # If the import fails or is cancelled, the sessions it created are
+    # deleted again. Progress is reported in bytes read.
+    # Returns (sessions, messages) added.
+    total = os.path.getsize(path)
+    keep = {}
+    batch = []
+    finished = []
+    in_flight = None
+    messages = 0
+
+    def settle():
+        # keep only learns a chunk's decisions once the chunk has committed.
+        nonlocal in_flight, messages
+        if in_flight is not None:
+            added, decided = in_flight.result()
+            in_flight = None
+            messages += added
+            keep.update(decided)
+
+    def flush():
+        nonlocal in_flight
+        settle()
+        in_flight = db.write(_import_chunk, dict(keep), list(batch), list(finished))
+        batch.clear()
+        finished.clear()
+
+    try:
+        last = None
+        with open(path, "rb") as raw, _text_reader(raw) as f:
+            for n, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    m = json.loads(line)
+                    if "format" in m:
+                        if m["format"] != ARCHIVE_HEADER["format"] or m.get("version", 1) > ARCHIVE_HEADER["version"]:
+                            raise ValueError(f"unsupported archive {m['format']} v{m.get('version')}")
+                        continue
+                    sid, role, content = str(m["session_id"]), m["role"], m["content"]
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"{path}:{n}: not a chat export line ({e})")
+                if sid != last:
+                    if last is not None:
+                        finished.append(last)
+                    if sid in finished:
+                        finished.remove(sid)
+                    last = sid
+                batch.append((sid, m.get("session_created_at") or m.get("created_at") or utc_now_iso(),
+                              role, content, m.get("created_at") or utc_now_iso(),
+                              int(bool(m.get("truncated"))), m.get("model")))
+                if len(batch) >= batch_size:
+                    flush()
+                    if stop is not None and stop.is_set():
+                        raise Cancelled()
+                    if progress:
+                        progress(raw.tell(), total)
+            if last is not None:
+                finished.append(last)
+            if batch or finished:
+                flush()
+            settle()
+    except BaseException:
+        if in_flight is not None:
+            wait([in_flight])
+            if in_flight.exception() is None:
+                keep.update(in_flight.result()[1])
+        db.write(_delete_sessions, keep).result()
+        raise
+    if progress:
+        progress(total, total)
+    return sum(keep.values()), messages
+
+
+# Writer jobs. `keep` maps each session id seen in earlier, committed chunks
+# to whether this import is adding its messages; a chunk returns the
+# decisions it made for new ids.
+def _import_chunk(conn: sqlite3.Connection, keep: dict, rows: list, finished: list):
+    decided = {}
+    params = []
+    for sid, session_created_at, role, content, created_at, truncated, model in rows:
+        if sid not in keep and sid not in decided:
+            decided[sid] = _claim_session(conn, sid, session_created_at)
+        elif keep.get(sid) and sid not in decided:
+            # Seen before in this file and already marked complete; the file
+            # has more of it after all.
+            conn.execute("UPDATE session_imports SET complete = 0 WHERE session_id = ?", (sid,))
+            decided[sid] = True
+        if decided.get(sid, keep.get(sid)):
+            params.append((sid, role, content, created_at, estimate_tokens(content), truncated, model))
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content, created_at, token_count, truncated, model) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        params
+    )
+    # Only sessions this import added have a row left at complete = 0.
+    conn.executemany("UPDATE session_imports SET complete = 1 WHERE session_id = ?", [(sid,) for sid in finished])
+    return len(params), decided
+
+
+def _claim_session(conn: sqlite3.Connection, sid: str, created_at: str) -> bool:
+    # True if this import adds the session's messages: it is new, or an
+    # earlier import of it never completed and its partial copy is dropped.
+    cur = conn.execute("INSERT OR IGNORE INTO sessions (id, created_at) VALUES (?, ?)", (sid, created_at))
+    if cur.rowcount == 1:
+        conn.execute("INSERT OR REPLACE INTO session_imports (session_id, complete) VALUES (?, 0)", (sid,))
+        return True
+    row = conn.execute("SELECT complete FROM session_imports WHERE session_id = ?", (sid,)).fetchone()
+    if row is None or row[0]:
+        return False
+    _clear_session(conn, sid)
+    return True
+
+
+def _clear_session(conn: sqlite3.Connection, sid: str):
+    conn.execute("DELETE FROM embeddings WHERE message_id IN (SELECT id FROM messages WHERE session_id = ?)",
+                 (sid,))
+    conn.execute("DELETE FROM messages WHERE session_id = ?", (sid,))
+    conn.execute("DELETE FROM summaries WHERE session_id = ?", (sid,))
+
+
+def _delete_sessions(conn: sqlite3.Connection, keep: dict):
+    for sid in [sid for sid, created in keep.items() if created]:
+        _clear_session(conn, sid)
+        conn.execute("DELETE FROM session_imports WHERE session_id = ?", (sid,))
+        conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import http_pool
+from db import Database
+from llm_client import MODEL_SETTINGS, LLMClient, settings_with
+from metrics import StreamMetrics
+from scheduler import GenerationScheduler
+
+
+# Deterministic session ids, so a resumed run never writes a job twice.
+SESSION_NAMESPACE = uuid.UUID("0f6f1d1e-5c0b-4d52-9a53-6b1f3c1f0a77")
+
+OVERRIDES = ("mode", "model", "temperature", "max_tokens", "system_prompt")
+
+
+# Headless runs of a JSONL prompt file. Each input line is one job:
+#   {"id": "q1", "prompt": "..."} or {"id": "q1", "messages": [...]}
+# optionally with "system", "mode", "model", "temperature" or "max_tokens".
+# Results are appended to the output JSONL as each job finishes; rerunning
+# with the same output file skips jobs that already completed.
+def load_jobs(path: Path) -> List[Dict]:
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"line-{n}")
+            job["id"] = str(job["id"])
+            if "messages" not in job:
+                if "prompt" not in job:
+                    raise ValueError(f"{path}:{n}: expected 'prompt' or 'messages'")
+                job["messages"] = [{"role": "user", "content": job["prompt"]}]
+            if "system" in job:
+                job["messages"] = [{"role": "system", "content": job["system"]}] + job["messages"]
+            jobs.append(job)
+    return jobs
+
+
+def completed_ids(path: Path, retry_errors: bool = True) -> set:
+    # Ids already in the output file. A crash can leave a half-written last
+    # line; it is cut off so appended results start on a fresh line.
+    if not path.exists():
+        return set()
+    data = path.read_bytes()
+    if data and not data.endswith(b"\n"):
+        data = data[:data.rfind(b"\n") + 1]
+        with open(path, "r+b") as f:
+            f.truncate(len(data))
+    done = set()
+    for line in data.splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        if result.get("status") == "ok" or not retry_errors:
+            done.add(str(result.get("id")))
+    return done
+
+
+class BatchRunner:
+    def __init__(self, settings: Dict, db: Optional[Database], out_path: Path, workers: int = 4,
+                 rates: Optional[Dict[str, float]] = None, batch_name: str = ""):
+        self.settings = settings
+        self.db = db
+        self.out_path = out_path
+        self.batch_name = batch_name
+        self.scheduler = GenerationScheduler(
+            settings.get("provider_concurrency"), rates=rates, max_in_flight=workers
+        )
+        self._clients = {}
+        self.finished = 0
+        self.failed = 0
+
+    def client_for(self, job: Dict) -> LLMClient:
+        # One client per distinct set of per-job overrides.
+        overrides = {k: job[k] for k in OVERRIDES if k in job}
+        key = json.dumps(overrides, sort_keys=True)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = LLMClient(settings_with(self.settings, **overrides), self.db)
+        return client
+
+    def session_id(self, job: Dict) -> str:
+        if "session_id" in job:
+            return str(job["session_id"])
+        return str(uuid.uuid5(SESSION_NAMESPACE, f"{self.batch_name}:{job['id']}"))
+
+    async def run(self, jobs: List[Dict]):
+        total = len(jobs)
+        with open(self.out_path, "a", encoding="utf-8") as out:
+            tasks = [asyncio.ensure_future(self._run_job(job)) for job in jobs]
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                self.finished += 1
+                if result["status"] != "ok":
+                    self.failed += 1
+                print(f"[{self.finished}/{total}] {result['id']} {result['status']} "
+                      f"{(result.get('total_ms') or 0) / 1000:.1f}s", file=sys.stderr)
+
+    async def _run_job(self, job: Dict) -> Dict:
+        client = self.client_for(job)
+        session_id = self.session_id(job)
+        metrics = StreamMetrics(client.mode, client.model, session_id)
+        result = {"id": job["id"], "session_id": session_id, "provider": client.mode, "model": client.model}
+
+        # Jobs may share a session_id, so the callbacks use this job's
+        # metrics rather than looking them up by session.
+        def on_start(_):
+            # Timings start when the job leaves the queue, not when it was queued.
+            metrics.started = time.perf_counter()
+
+        def on_chunk(_, piece: str):
+            metrics.mark_chunk(piece)
+
+        try:
+            text = await self.scheduler.run(client, job["messages"], session_id, on_chunk, on_start, metrics)
+            metrics.finish("ok")
+            result.update(status="ok", response=text)
+        except Exception as e:
+            metrics.finish("error")
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+            text = None
+        # metrics names the provider that answered, which after a failover
+        # is not client.mode.
+        row = metrics.to_row()
+        result.update(provider=metrics.provider, model=metrics.model, ttft_ms=row["ttft_ms"], total_ms=row["total_ms"], tokens=row["tokens"],
+                      tokens_per_sec=row["tokens_per_sec"])
+        if self.db is not None:
+            # Queued to the database's writer thread; nothing here waits.
+            self._record(session_id, job["messages"], text, row, continued="session_id" in job)
+        return result
+
+    def _record(self, session_id: str, messages: List[Dict], text: Optional[str], row: Dict,
+                continued: bool = False):
+        # A job naming an existing session continues it, so only its latest
+        # user turn is added. A derived session id that already exists was
+        # recorded by an earlier, interrupted run and is left alone. The
+        # writer thread checks which case applies inside the transaction.
+        self.db.add_metrics(row)
+        if text is None:
+            return
+        self.db.add_exchange(session_id, messages, text, model=row["model"], append=continued)
+
+
+def parse_rates(values: List[str]) -> Dict[str, float]:
+    rates = {}
+    for value in values or []:
+        provider, _, rate = value.partition("=")
+        if not rate:
+            raise argparse.ArgumentTypeError(f"expected provider=requests_per_minute, got {value!r}")
+        rates[provider] = float(rate)
+    return rates
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Run a JSONL prompt file without the GUI")
+    parser.add_argument("input", type=Path)
+    parser.add_argument("-o", "--output", type=Path, help="results JSONL (default: <input>.results.jsonl)")
+    parser.add_argument("--settings", type=Path, default=Path(__file__).resolve().parent / "settings.json")
+    parser.add_argument("--db", default="chat_history.db", help="database to record runs in")
+    parser.add_argument("--no-db", action="store_true", help="do not record runs in the database")
+    parser.add_argument("--mode", choices=sorted(MODEL_SETTINGS), help="provider for jobs that do not set one")
+    parser.add_argument("--workers", type=int, default=4, help="generations in flight at once")
+    parser.add_argument("--rpm", nargs="*", metavar="PROVIDER=N", help="requests per minute per provider")
+    parser.add_argument("--no-retry-errors", action="store_true", help="on resume, skip jobs that failed before")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.settings.exists():
+        with open(args.settings) as f:
+            settings = json.load(f)
+    if args.mode:
+        settings["mode"] = args.mode
+    rates = dict(settings.get("batch_rate_limits", {}))
+    rates.update(parse_rates(args.rpm))
+
+    output = args.output or args.input.with_suffix(".results.jsonl")
+    jobs = load_jobs(args.input)
+    done = completed_ids(output, retry_errors=not args.no_retry_errors)
+    pending = [j for j in jobs if j["id"] not in done]
+    if done:
+        print(f"resuming: {len(jobs) - len(pending)} of {len(jobs)} jobs already done", file=sys.stderr)
+
+    db = None if args.no_db else Database(args.db)
+    runner = BatchRunner(settings, db, output, args.workers, rates, batch_name=str(args.input.resolve()))
+
+    async def _main():
+        try:
+            await runner.run(pending)
+        finally:
+            await http_pool.aclose_all()
+
+    started = time.perf_counter()
+    try:
+        asyncio.run(_main())
+    finally:
+        http_pool.close_all()
+        if db is not None:
+            # Semantic memory writes through the Database, so it stops first.
+            memory = sys.modules.get("memory")
+            if memory is not None:
+                memory.close_all()
+            db.close()
+    elapsed = time.perf_counter() - started
+    print(f"{runner.finished} jobs in {elapsed:.1f}s, {runner.failed} failed -> {output}", file=sys.stderr)
+    return 1 if runner.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
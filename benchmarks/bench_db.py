@@ -0,0 +1,79 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database
+
+MESSAGES_PER_SESSION = 100
+CONTENT = "The quick brown fox jumps over the lazy dog. " * 8
+
+
+def populate(db: Database, total: int):
+    # One writer job per session; the writer commits whatever has queued up
+    # together. Flushing now and then keeps the queue from growing unbounded.
+    sessions = []
+    for start in range(0, total, MESSAGES_PER_SESSION):
+        session_id = db.start_new_session()
+        sessions.append(session_id)
+        count = min(MESSAGES_PER_SESSION, total - start)
+        db.add_messages(
+            (session_id, "user" if i % 2 == 0 else "assistant", CONTENT) for i in range(count)
+        )
+        if len(sessions) % 100 == 0:
+            db.flush()
+    db.flush()
+    return sessions
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run(total: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = Database(path)
+        t0 = time.perf_counter()
+        sessions = populate(db, total)
+        load_s = time.perf_counter() - t0
+
+        target = sessions[len(sessions) // 2]
+        # Until the write has committed, not just been queued.
+        insert = timed(lambda: db.add_message(target, "user", CONTENT).result(), repeat)
+        lookup = timed(lambda: db.get_messages(target, as_openai_format=True), repeat)
+
+        db.write(lambda conn: conn.execute("DROP INDEX idx_messages_session_id")).result()
+        scan = timed(lambda: db.get_messages(target, as_openai_format=True), max(3, repeat // 10))
+        db.close()
+
+    print(
+        f"{total:>9,} msgs | bulk load {total / load_s:>9,.0f} rows/s | "
+        f"insert p50 {insert[0]:6.3f} ms p95 {insert[1]:6.3f} ms | "
+        f"lookup p50 {lookup[0]:6.3f} ms p95 {lookup[1]:6.3f} ms | "
+        f"lookup without index p50 {scan[0]:8.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite insert and lookup latency by history size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database, configure_connection, utc_now_iso
+
+CONTENT = "The quick brown fox jumps over the lazy dog. " * 4
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.reads = []
+        self.errors = {}
+
+    def error(self, e: Exception):
+        with self.lock:
+            key = f"{type(e).__name__}: {e}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def run_shared(path: str, writers: int, readers: int, seconds: float) -> Counters:
+    # Every thread shares one Database: writes go through its writer thread,
+    # reads through its pool. Writers wait for their commit, as the GUI's
+    # reads do implicitly.
+    db = Database(path)
+    history = db.start_new_session()
+    counters = Counters()
+    stop = threading.Event()
+
+    def write_loop():
+        session_id = db.start_new_session()
+        n = 0
+        while not stop.is_set():
+            try:
+                db.add_message(session_id, "user" if n % 2 == 0 else "assistant", CONTENT).result()
+                with counters.lock:
+                    counters.writes += 1
+            except Exception as e:
+                counters.error(e)
+            n += 1
+
+    def read_loop():
+        samples = []
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                db.get_messages_page(history, limit=50)
+                db.recent_metrics(1)
+            except Exception as e:
+                counters.error(e)
+            samples.append((time.perf_counter() - t0) * 1000)
+        with counters.lock:
+            counters.reads.extend(samples)
+
+    _run_threads(write_loop, read_loop, writers, readers, seconds, stop)
+    db.close()
+    return counters
+
+
+def run_separate(path: str, writers: int, readers: int, seconds: float) -> Counters:
+    # The pattern this replaces: each thread with a connection of its own,
+    # committing every write and competing for the database lock.
+    db = Database(path)
+    history = db.start_new_session()
+    db.close()
+    counters = Counters()
+    stop = threading.Event()
+
+    def connect():
+        conn = sqlite3.connect(path)
+        configure_connection(conn)
+        return conn
+
+    def write_loop():
+        conn = connect()
+        session_id = f"s{threading.get_ident()}"
+        with conn:
+            conn.execute("INSERT INTO sessions (id, created_at) VALUES (?, ?)", (session_id, utc_now_iso()))
+        n = 0
+        while not stop.is_set():
+            try:
+                with conn:
+                    # Read, then write: the way add_message used to be called
+                    # after a session_exists check.
+                    conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+                    conn.execute(
+                        "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                        (session_id, "user" if n % 2 == 0 else "assistant", CONTENT, utc_now_iso())
+                    )
+                with counters.lock:
+                    counters.writes += 1
+            except sqlite3.OperationalError as e:
+                counters.error(e)
+            n += 1
+        conn.close()
+
+    def read_loop():
+        conn = connect()
+        samples = []
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                conn.execute(
+                    "SELECT id, role, content, created_at, truncated, model FROM messages WHERE session_id = ? "
+                    "ORDER BY id DESC LIMIT 50",
+                    (history,)
+                ).fetchall()
+                conn.execute("SELECT * FROM metrics ORDER BY id DESC LIMIT 1").fetchall()
+            except sqlite3.OperationalError as e:
+                counters.error(e)
+            samples.append((time.perf_counter() - t0) * 1000)
+        conn.close()
+        with counters.lock:
+            counters.reads.extend(samples)
+
+    _run_threads(write_loop, read_loop, writers, readers, seconds, stop)
+    return counters
+
+
+def _run_threads(write_loop, read_loop, writers: int, readers: int, seconds: float, stop: threading.Event):
+    threads = [threading.Thread(target=write_loop) for _ in range(writers)]
+    threads += [threading.Thread(target=read_loop) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+
+def report(label: str, counters: Counters, seconds: float):
+    reads = sorted(counters.reads) or [0.0]
+    errors = sum(counters.errors.values())
+    print(
+        f"{label:>22} | {counters.writes / seconds:>8,.0f} writes/s | "
+        f"{len(counters.reads) / seconds:>7,.0f} reads/s p50 {statistics.median(reads):6.2f} ms "
+        f"p99 {reads[int(len(reads) * 0.99) - 1]:7.2f} ms | errors {errors}"
+    )
+    for message, count in counters.errors.items():
+        print(f"{'':>24}{count:>6} x {message}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent writers and readers on one chat history database")
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--baseline", action="store_true", help="also run separate connections per thread")
+    args = parser.parse_args()
+
+    print(f"{args.writers} writer threads, {args.readers} reader threads, {args.seconds:.0f} s each")
+    with tempfile.TemporaryDirectory() as tmp:
+        counters = run_shared(os.path.join(tmp, "shared.db"), args.writers, args.readers, args.seconds)
+        errors = report("writer thread + pool", counters, args.seconds)
+        if args.baseline:
+            counters = run_separate(os.path.join(tmp, "separate.db"), args.writers, args.readers, args.seconds)
+            report("separate connections", counters, args.seconds)
+    # The shared Database must never see "database is locked" and friends.
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
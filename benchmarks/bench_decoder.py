@@ -0,0 +1,136 @@
+import argparse
+import codecs
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import llm_client
+import stream_decoder
+from mock_providers import anthropic_events, ollama_events, openai_events, _token
+
+FORMATS = {
+    "offline": (ollama_events, stream_decoder.NDJSONDecoder, llm_client._ollama_text),
+    "openai": (openai_events, stream_decoder.SSEDecoder, llm_client._openai_text),
+    "anthropic": (anthropic_events, stream_decoder.SSEDecoder, llm_client._anthropic_text),
+}
+
+
+def wire_chunks(events, tokens: int, events_per_chunk: int):
+    texts = (_token(i) for i in range(tokens))
+    chunks, batch = [], []
+    for event in events(texts):
+        batch.append(event.encode("utf-8"))
+        if len(batch) >= events_per_chunk:
+            chunks.append(b"".join(batch))
+            batch = []
+    if batch:
+        chunks.append(b"".join(batch))
+    return chunks
+
+
+# The line-based path the providers used before stream_decoder: requests'
+# iter_lines(decode_unicode=True) followed by per-line str.replace and json.loads.
+def legacy_iter_lines(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = None
+    for chunk in chunks:
+        chunk = decoder.decode(chunk)
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def legacy_parse(mode: str, line: str):
+    if mode == "offline":
+        try:
+            return json.loads(line).get("message", {}).get("content", "")
+        except json.JSONDecodeError:
+            return None
+    if not line.startswith("data:"):
+        return None
+    data_str = line.replace("data: ", "").strip()
+    if data_str == "[DONE]":
+        return False
+    try:
+        data = json.loads(data_str)
+    except json.JSONDecodeError:
+        return None
+    if mode == "openai":
+        return data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+    return data.get("delta", {}).get("text", "") if "delta" in data else None
+
+
+def run_legacy(mode: str, chunks) -> str:
+    full_text = ""
+    for line in legacy_iter_lines(chunks):
+        if not line:
+            continue
+        piece = legacy_parse(mode, line)
+        if piece is False:
+            break
+        if piece:
+            full_text += piece
+    return full_text
+
+
+def run_decoder(mode: str, chunks) -> str:
+    _, decoder_cls, extract = FORMATS[mode]
+    req = llm_client.ProviderRequest("", "", {}, {}, decoder_cls, extract)
+    decoder = decoder_cls()
+    parts = []
+    for data in chunks:
+        pieces, done = llm_client._texts(req, decoder.feed(data))
+        parts.extend(pieces)
+        if done:
+            break
+    return "".join(parts)
+
+
+def timed(fn, *args, repeat: int = 7):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream decoding throughput: line-based parsing vs stream_decoder")
+    parser.add_argument("--tokens", type=int, default=100_000)
+    parser.add_argument("--events-per-chunk", type=int, default=64)
+    args = parser.parse_args()
+
+    backends = [("json", json.loads)]
+    try:
+        import orjson
+        backends.append(("orjson", orjson.loads))
+    except ImportError:
+        pass
+
+    for mode, (events, _, _) in FORMATS.items():
+        chunks = wire_chunks(events, args.tokens, args.events_per_chunk)
+        legacy_s, expected = timed(run_legacy, mode, chunks)
+        line = f"{mode:>9} | {args.tokens:,} tokens | legacy {args.tokens / legacy_s:>10,.0f} tok/s"
+        for name, loads in backends:
+            stream_decoder.loads = loads
+            new_s, text = timed(run_decoder, mode, chunks)
+            assert text == expected, "decoder output differs from legacy parser"
+            line += f" | {name} {args.tokens / new_s:>10,.0f} tok/s ({legacy_s / new_s:.1f}x)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
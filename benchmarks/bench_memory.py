@@ -0,0 +1,91 @@
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from memory import ExactIndex, HNSWIndex
+
+
+def synthetic_vectors(n: int, dim: int, rng: np.random.Generator, clusters: int = 1000) -> np.ndarray:
+    # Gaussian clusters rather than uniform noise: chat embeddings bunch up
+    # around topics, and uniform data is an unrealistically hard case for
+    # approximate search.
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    step = 100000
+    for start in range(0, n, step):
+        count = min(step, n - start)
+        labels = rng.integers(0, clusters, count)
+        block = centers[labels] + 0.6 * rng.standard_normal((count, dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        out[start:start + count] = block
+    return out
+
+
+def restated(vectors: np.ndarray, count: int, rng: np.random.Generator, noise: float = 0.5) -> np.ndarray:
+    # Queries that paraphrase a stored message: a stored vector plus noise.
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    scale = np.float32(noise / np.sqrt(vectors.shape[1]))
+    queries = picks + scale * rng.standard_normal(picks.shape, dtype=np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def timed(search, queries, k: int, exclude: int):
+    latencies, results = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        ids, _ = search(q, k, exclude)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(set(ids.tolist()))
+    latencies.sort()
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    return statistics.median(latencies), p95, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic memory top-k retrieval latency")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--ann", action="store_true", help="also build and query an hnswlib index")
+    parser.add_argument("--ef", type=int, default=128)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for n in args.sizes:
+        vectors = synthetic_vectors(n, args.dim, rng)
+        ids = np.arange(1, n + 1, dtype=np.int64)
+        sessions = rng.integers(0, args.sessions, n).astype(np.int32)
+        queries = restated(vectors, args.queries, rng)
+        exclude = int(sessions[-1])
+
+        exact = ExactIndex(args.dim, n)
+        exact.add(ids, sessions, vectors)
+        p50, p95, truth = timed(exact.search, queries, args.k, exclude)
+        mb = vectors.nbytes / 1e6
+        print(f"{n:>9,} x {args.dim} | exact  p50 {p50:7.2f} ms  p95 {p95:7.2f} ms | {mb:,.0f} MB")
+
+        if args.ann:
+            session_of = np.full(n + 1, -1, dtype=np.int32)
+            session_of[ids] = sessions
+            t0 = time.perf_counter()
+            ann = HNSWIndex(args.dim, n, ef=args.ef)
+            ann.add(ids, sessions, vectors)
+            build_s = time.perf_counter() - t0
+            p50, p95, found = timed(lambda q, k, e: ann.search(q, k, e, session_of), queries, args.k, exclude)
+            recall = statistics.mean(len(f & t) / max(1, len(t)) for f, t in zip(found, truth))
+            print(f"{n:>9,} x {args.dim} | hnsw   p50 {p50:7.2f} ms  p95 {p95:7.2f} ms | "
+                  f"recall@{args.k} {recall:.3f} | build {build_s:.0f} s")
+            del ann
+        del exact, vectors
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database
+
+MESSAGES_PER_SESSION = 100
+VOCABULARY = [f"word{i}" for i in range(20_000)]
+QUERIES = ["word17", "word123 word456", "word99", "word1234 word5", "word4321"]
+
+
+def populate(db: Database, total: int, rng: random.Random):
+    for n, start in enumerate(range(0, total, MESSAGES_PER_SESSION), start=1):
+        session_id = db.start_new_session()
+        count = min(MESSAGES_PER_SESSION, total - start)
+        db.add_messages(
+            (session_id, "user", " ".join(rng.choices(VOCABULARY, k=40))) for _ in range(count)
+        )
+        if n % 100 == 0:
+            db.flush()
+    db.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FTS5 search latency over chat history")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    for total in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "bench.db"))
+            populate(db, total, rng)
+            samples = []
+            for _ in range(args.repeat):
+                for q in QUERIES:
+                    t0 = time.perf_counter()
+                    db.search(q, limit=20)
+                    samples.append((time.perf_counter() - t0) * 1000)
+            samples.sort()
+            db.close()
+        print(
+            f"{total:>9,} msgs | search p50 {statistics.median(samples):7.2f} ms "
+            f"p95 {samples[int(len(samples) * 0.95) - 1]:7.2f} ms max {samples[-1]:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from metrics import percentile
+import mock_providers
+
+PROMPT = [{"role": "user", "content": "Benchmark prompt"}]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(settings: dict, port: int, db_path: str = None):
+    # With a db_path every request is logged to a Database, as `main.py
+    # serve` does by default.
+    from aiohttp import web
+    from db import Database
+    from server import ChatServer
+    db = Database(db_path) if db_path else None
+    web.run_app(ChatServer(settings, db).make_app(), host="127.0.0.1", port=port, access_log=None, print=None)
+
+
+async def _wait_ready(base: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(base + "/health") as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("server did not start")
+            await asyncio.sleep(0.1)
+
+
+async def _one(session: aiohttp.ClientSession, url: str, model: str, stats: dict):
+    started = time.perf_counter()
+    ttft = None
+    body = {"model": model, "messages": PROMPT, "stream": True}
+    try:
+        async with session.post(url, json=body) as r:
+            if r.status == 429:
+                stats["rejected"] += 1
+                await asyncio.sleep(float(r.headers.get("Retry-After", 1)) / 10)
+                return
+            if r.status != 200:
+                stats["errors"] += 1
+                return
+            async for line in r.content:
+                if not line.startswith(b"data: "):
+                    continue
+                if line.startswith(b"data: [DONE]"):
+                    break
+                chunk = json.loads(line[6:])
+                if "error" in chunk:
+                    stats["errors"] += 1
+                    return
+                if ttft is None and chunk["choices"][0]["delta"].get("content"):
+                    ttft = time.perf_counter() - started
+    except aiohttp.ClientError:
+        stats["errors"] += 1
+        return
+    stats["ttft"].append(ttft * 1000 if ttft is not None else None)
+    stats["total"].append((time.perf_counter() - started) * 1000)
+
+
+async def load(base: str, model: str, concurrency: int, duration: float) -> dict:
+    stats = {"ttft": [], "total": [], "errors": 0, "rejected": 0}
+    url = base + "/v1/chat/completions"
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def user():
+            while time.perf_counter() < deadline:
+                await _one(session, url, model, stats)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    stats["elapsed"] = elapsed
+    return stats
+
+
+def _run_server(args, settings: dict, db_path: str, label: str) -> list:
+    port = _free_port()
+    proc = multiprocessing.get_context("spawn").Process(target=_serve, args=(settings, port, db_path), daemon=True)
+    proc.start()
+    base = f"http://127.0.0.1:{port}"
+    failures = []
+    try:
+        asyncio.run(_wait_ready(base))
+        for concurrency in args.concurrency:
+            s = asyncio.run(load(base, args.provider, concurrency, args.duration))
+            done = len(s["total"])
+            rps = done / s["elapsed"]
+            ttft = [v for v in s["ttft"] if v is not None]
+            p = {q: percentile(s["total"], q) for q in (50, 95, 99)}
+            t = {q: percentile(ttft, q) for q in (50, 95, 99)}
+            print(
+                f"c={concurrency:>4} | {done} ok, {s['rejected']} 429, {s['errors']} errors | {rps:7.1f} req/s | "
+                f"ttft p50 {_fmt(t[50])} p95 {_fmt(t[95])} p99 {_fmt(t[99])} ms | "
+                f"total p50 {_fmt(p[50])} p95 {_fmt(p[95])} p99 {_fmt(p[99])} ms"
+            )
+            if args.min_rps is not None and rps < args.min_rps:
+                failures.append(f"{label}c={concurrency}: {rps:.1f} req/s < {args.min_rps:.1f}")
+            if args.max_p99_ms is not None and (p[99] is None or p[99] > args.max_p99_ms):
+                failures.append(f"{label}c={concurrency}: p99 {_fmt(p[99])} ms > {args.max_p99_ms:.1f}")
+    finally:
+        proc.terminate()
+        proc.join()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sustained load against the OpenAI-compatible server mode")
+    parser.add_argument("--provider", default="offline", choices=["offline", "openai", "anthropic"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--provider-limit", type=int, default=16, help="server provider_concurrency")
+    parser.add_argument("--max-queue", type=int, default=64, help="server server_max_queue")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per response")
+    parser.add_argument("--token-rate", type=float, default=0, help="mock tokens/sec, 0 = unthrottled")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--db", choices=["on", "off", "both"], default="both",
+                        help="log requests to a temporary database, as serve does by default")
+    parser.add_argument("--min-rps", type=float, help="fail if sustained requests/sec is lower")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if p99 total latency is higher")
+    args = parser.parse_args()
+
+    config = {"tokens": args.tokens, "token_rate": args.token_rate, "latency_ms": args.latency_ms, "seed": 0}
+    mock, mock_url = mock_providers.start_in_process(config)
+    settings = {
+        "mode": args.provider,
+        "ollama_base_url": mock_url,
+        "openai_base_url": mock_url,
+        "anthropic_base_url": mock_url,
+        "openai_api_key": "mock",
+        "anthropic_api_key": "mock",
+        "cache_enabled": False,
+        "ollama_preload": False,
+        "provider_concurrency": {args.provider: args.provider_limit},
+        "server_max_queue": args.max_queue,
+    }
+    failures = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for db in (("on", "off") if args.db == "both" else (args.db,)):
+                print(f"db {db}")
+                db_path = os.path.join(tmp, "bench.db") if db == "on" else None
+                failures += _run_server(args, settings, db_path, f"db {db} ")
+    finally:
+        mock.terminate()
+
+    if args.min_rps is not None or args.max_p99_ms is not None:
+        for f in failures:
+            print("FAIL:", f)
+        print("PASS" if not failures else "FAIL")
+        sys.exit(1 if failures else 0)
+
+
+def _fmt(value, spec: str = ".1f") -> str:
+    return "-" if value is None else format(value, spec)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+# Runs in a fresh interpreter per sample. Prints seconds from launch to the
+# window being shown, then to the history being open and the input enabled.
+CHILD = r"""
+import os, sys, time
+t0 = float(os.environ["BENCH_T0"])
+sys.path.insert(0, os.environ["BENCH_REPO"])
+settings_path, db_path, eager = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import QApplication
+app = QApplication([])
+if eager:
+    # What startup did before: provider stack and database first, window after.
+    import json
+    from db import Database
+    from llm_client import LLMClient
+    with open(settings_path) as f:
+        LLMClient(json.load(f), Database(db_path))
+from gui import MainWindow
+window = MainWindow(settings_path, db_path)
+window.show()
+QTimer.singleShot(0, lambda: print("shown", time.time() - t0, flush=True))
+poll = QTimer()
+def ready():
+    if window.input.isEnabled():
+        print("ready", time.time() - t0, flush=True)
+        poll.stop()
+        app.quit()
+poll.timeout.connect(ready)
+poll.start(1)
+app.exec()
+print("modules", int("llm_client" in sys.modules), int("requests" in sys.modules), flush=True)
+"""
+
+
+def seed_history(db_path: str, messages: int):
+    from db import Database
+    db = Database(db_path)
+    with db.batch():
+        session = db.start_new_session()
+        for i in range(messages):
+            if i % 200 == 0:
+                session = db.start_new_session()
+            db.add_message(session, "user" if i % 2 == 0 else "assistant", f"message {i} " + "lorem ipsum " * 20)
+    db.close()
+
+
+def sample(settings_path: str, db_path: str, eager: bool) -> dict:
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", BENCH_REPO=str(REPO), BENCH_T0=repr(time.time()))
+    out = subprocess.run([sys.executable, "-c", CHILD, settings_path, db_path, "1" if eager else "0"],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    result = {}
+    for line in out.splitlines():
+        key, *values = line.split()
+        result[key] = [float(v) for v in values]
+    return result
+
+
+def import_profile(module: str, top: int):
+    # python -X importtime reports "self | cumulative | name" in microseconds.
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=REPO, capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level.
+        rows.append((int(cumulative_us), name[1:].rstrip()))
+    # A module's own row comes after those of everything it imported.
+    end = next(i for i, r in enumerate(rows) if r[1] == module)
+    start = max((i + 1 for i, r in enumerate(rows[:end]) if not r[1].startswith(" ")), default=0)
+    children = [r for r in rows[start:end] if r[1].startswith("  ") and not r[1].startswith("   ")]
+    print(f"import {module}: {rows[end][0] / 1000:.0f} ms cumulative")
+    for cumulative, name in sorted(children, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time from launch to window shown, eager vs deferred startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=20000, help="messages in the seeded history")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    args = parser.parse_args()
+
+    for module in ("gui", "llm_client"):
+        import_profile(module, args.top)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings_path = os.path.join(tmp, "settings.json")
+        db_path = os.path.join(tmp, "chat_history.db")
+        with open(settings_path, "w") as f:
+            json.dump({"mode": "offline", "ollama_preload": False}, f)
+        seed_history(db_path, args.messages)
+        print(f"\nstartup with {args.messages:,} messages of history, median of {args.runs} runs")
+        for label, eager in (("eager", True), ("deferred", False)):
+            runs = [sample(settings_path, db_path, eager) for _ in range(args.runs)]
+            shown = statistics.median(r["shown"][0] for r in runs) * 1000
+            ready = statistics.median(r["ready"][0] for r in runs) * 1000
+            imported = "yes" if runs[-1]["modules"][1] else "no"
+            print(f"{label:>9} | window shown {shown:6.0f} ms | history ready {ready:6.0f} ms | "
+                  f"requests imported: {imported}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import http_pool
+from llm_client import CancelToken, LLMClient
+from metrics import StreamMetrics, percentile
+import mock_providers
+
+PROVIDERS = ["offline", "openai", "anthropic"]
+MESSAGES = [{"role": "user", "content": "Benchmark prompt"}]
+HEADER_DELAY_MS = 3000  # the mock used for the cancel check answers this late
+
+
+def client_for(mode: str, base_url: str) -> LLMClient:
+    settings = {
+        "mode": mode,
+        "ollama_base_url": base_url,
+        "openai_base_url": base_url,
+        "anthropic_base_url": base_url,
+        "openai_api_key": "mock",
+        "anthropic_api_key": "mock",
+    }
+    return LLMClient(settings, None)
+
+
+def run_once(client: LLMClient, trace_memory: bool = False):
+    metrics = StreamMetrics(client.mode, client.model)
+    if trace_memory:
+        tracemalloc.start()
+    parts = []
+    error = None
+    try:
+        for piece in client.stream_chat(MESSAGES, session_id="bench", metrics=metrics):
+            parts.append(piece)
+    except Exception as e:
+        error = e
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    text = "".join(parts)
+    return metrics, len(text), peak, error
+
+
+def bench_provider(mode: str, base_url: str, runs: int):
+    client = client_for(mode, base_url)
+    run_once(client)  # warm the pooled connection
+    ttft, tps, mbps, errors = [], [], [], 0
+    for _ in range(runs):
+        metrics, chars, _, error = run_once(client)
+        if error is not None:
+            errors += 1
+            continue
+        elapsed = (metrics.finished - metrics.started)
+        ttft.append((metrics.first_chunk - metrics.started) * 1000)
+        tps.append(metrics.token_count() / elapsed)
+        mbps.append(chars / elapsed / 1e6)
+    _, _, peak, _ = run_once(client, trace_memory=True)
+    return {
+        "provider": mode,
+        "runs": runs,
+        "errors": errors,
+        "ttft_p50_ms": percentile(ttft, 50),
+        "ttft_p95_ms": percentile(ttft, 95),
+        "tokens_per_sec": statistics.median(tps) if tps else None,
+        "mb_per_sec": statistics.median(mbps) if mbps else None,
+        "peak_mb": peak / 1e6 if peak is not None else None,
+    }
+
+
+def cancel_latency(mode: str, base_url: str, after: float = 0.1) -> float:
+    # Stop pressed while the provider has not sent headers yet, as when a
+    # model is still loading: the generator must end at once, not when the
+    # headers finally arrive.
+    client = client_for(mode, base_url)
+    cancel = CancelToken()
+    finished = threading.Event()
+
+    def consume():
+        try:
+            for _ in client.stream_chat(MESSAGES, session_id="bench", cancel=cancel):
+                pass
+        except Exception:
+            pass
+        finished.set()
+
+    threading.Thread(target=consume, daemon=True).start()
+    time.sleep(after)
+    t0 = time.perf_counter()
+    cancel.cancel()
+    finished.wait(HEADER_DELAY_MS / 1000 * 2)
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client streaming throughput against local mock providers")
+    parser.add_argument("--providers", nargs="+", default=PROVIDERS, choices=PROVIDERS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=20000, help="tokens per response")
+    parser.add_argument("--chunk-tokens", type=int, default=1)
+    parser.add_argument("--token-rate", type=float, default=0, help="mock tokens/sec, 0 = unthrottled")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--drop-after", type=int, default=0)
+    parser.add_argument("--min-tokens-per-sec", type=float, help="fail if client throughput is lower")
+    parser.add_argument("--max-ttft-ms", type=float, help="fail if p95 time to first token is higher")
+    parser.add_argument("--max-peak-mb", type=float, help="fail if peak client memory is higher")
+    parser.add_argument("--max-cancel-ms", type=float,
+                        help=f"cancel each provider before its headers ({HEADER_DELAY_MS} ms late) "
+                             "and fail if the stream takes longer to end")
+    args = parser.parse_args()
+
+    config = {
+        "tokens": args.tokens, "chunk_tokens": args.chunk_tokens, "token_rate": args.token_rate,
+        "latency_ms": args.latency_ms, "fail_rate": args.fail_rate, "drop_after": args.drop_after, "seed": 0,
+    }
+    proc, base_url = mock_providers.start_in_process(config)
+    failures = []
+    try:
+        for mode in args.providers:
+            r = bench_provider(mode, base_url, args.runs)
+            print(
+                f"{r['provider']:>9} | {args.tokens} tokens x {r['runs']} runs, {r['errors']} errors | "
+                f"ttft p50 {_fmt(r['ttft_p50_ms'])} ms p95 {_fmt(r['ttft_p95_ms'])} ms | "
+                f"{_fmt(r['tokens_per_sec'], '.0f')} tok/s {_fmt(r['mb_per_sec'], '.2f')} MB/s | "
+                f"peak {_fmt(r['peak_mb'], '.2f')} MB"
+            )
+            failures += check_thresholds(r, args)
+    finally:
+        http_pool.close_all()
+        proc.terminate()
+
+    if args.max_cancel_ms is not None:
+        proc, base_url = mock_providers.start_in_process(dict(config, latency_ms=HEADER_DELAY_MS))
+        try:
+            for mode in args.providers:
+                ms = cancel_latency(mode, base_url)
+                print(f"{mode:>9} | cancel before headers ended the stream in {ms:.1f} ms")
+                if ms > args.max_cancel_ms:
+                    failures.append(f"{mode}: cancel took {ms:.1f} ms > {args.max_cancel_ms:.1f}")
+        finally:
+            http_pool.close_all()
+            proc.terminate()
+
+    thresholds = (args.min_tokens_per_sec, args.max_ttft_ms, args.max_peak_mb, args.max_cancel_ms)
+    if any(v is not None for v in thresholds):
+        for f in failures:
+            print("FAIL:", f)
+        print("PASS" if not failures else "FAIL")
+        sys.exit(1 if failures else 0)
+
+
+def check_thresholds(r: dict, args) -> list:
+    failures = []
+    name = r["provider"]
+    if r["errors"] == r["runs"]:
+        return [f"{name}: every run failed"]
+    if args.min_tokens_per_sec is not None and r["tokens_per_sec"] < args.min_tokens_per_sec:
+        failures.append(f"{name}: {r['tokens_per_sec']:.0f} tok/s < {args.min_tokens_per_sec:.0f}")
+    if args.max_ttft_ms is not None and r["ttft_p95_ms"] > args.max_ttft_ms:
+        failures.append(f"{name}: ttft p95 {r['ttft_p95_ms']:.1f} ms > {args.max_ttft_ms:.1f}")
+    if args.max_peak_mb is not None and r["peak_mb"] is not None and r["peak_mb"] > args.max_peak_mb:
+        failures.append(f"{name}: peak {r['peak_mb']:.2f} MB > {args.max_peak_mb:.2f}")
+    return failures
+
+
+def _fmt(value, spec: str = ".1f") -> str:
+    return "-" if value is None else format(value, spec)
+
+
+if __name__ == "__main__":
+    main()
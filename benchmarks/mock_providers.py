@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-ins for the three provider streaming APIs, speaking the wire
+# formats LLMClient parses: Ollama NDJSON, OpenAI SSE terminated by [DONE],
+# and Anthropic SSE content_block_delta events.
+
+DEFAULT_CONFIG = {
+    "tokens": 500,          # tokens per response
+    "token_rate": 0,        # tokens per second, 0 = as fast as possible
+    "chunk_tokens": 1,      # tokens per wire event
+    "latency_ms": 0,        # delay before response headers
+    "fail_rate": 0.0,       # probability a request fails with fail_status
+    "fail_status": 500,
+    "drop_after": 0,        # cut the connection after this many tokens, 0 = never
+    "seed": None,
+}
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+
+
+def _token(i: int) -> str:
+    return WORDS[i % len(WORDS)] + " "
+
+
+def ollama_events(texts):
+    count = 0
+    started = time.perf_counter_ns()
+    for text in texts:
+        count += len(text.split())
+        yield json.dumps({"model": "mock", "message": {"role": "assistant", "content": text}, "done": False}) + "\n"
+    elapsed = time.perf_counter_ns() - started
+    yield json.dumps({
+        "model": "mock", "message": {"role": "assistant", "content": ""}, "done": True,
+        "total_duration": elapsed, "load_duration": 0, "prompt_eval_count": 0, "prompt_eval_duration": 0,
+        "eval_count": count, "eval_duration": elapsed,
+    }) + "\n"
+
+
+def openai_events(texts):
+    for text in texts:
+        event = {"id": "mock", "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+        yield "data: " + json.dumps(event) + "\n\n"
+    yield "data: " + json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}) + "\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def anthropic_events(texts):
+    yield 'event: message_start\ndata: {"type": "message_start", "message": {"id": "mock", "role": "assistant"}}\n\n'
+    yield ('event: content_block_start\ndata: {"type": "content_block_start", "index": 0, '
+           '"content_block": {"type": "text", "text": ""}}\n\n')
+    for text in texts:
+        event = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}}
+        yield "event: content_block_delta\ndata: " + json.dumps(event) + "\n\n"
+    yield 'event: content_block_stop\ndata: {"type": "content_block_stop", "index": 0}\n\n'
+    yield 'event: message_delta\ndata: {"type": "message_delta", "delta": {"stop_reason": "end_turn"}}\n\n'
+    yield 'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+
+
+def mock_embedding(text: str, dim: int = 64) -> list:
+    # Hashed bag of words: texts sharing words get similar vectors, which is
+    # enough to exercise retrieval without a real embedding model.
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    return vector
+
+
+ROUTES = {
+    "/api/chat": ("application/x-ndjson", ollama_events),
+    "/v1/chat/completions": ("text/event-stream", openai_events),
+    "/v1/messages": ("text/event-stream", anthropic_events),
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = DEFAULT_CONFIG
+    rng = random.Random()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "mock"}]})
+        elif self.path == "/v1/models":
+            self._send_json(200, {"data": [{"id": "mock"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path == "/api/embed":
+            inputs = json.loads(body)["input"]
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json(200, {"model": "mock", "embeddings": [mock_embedding(t) for t in inputs]})
+            return
+        route = ROUTES.get(self.path)
+        if route is None:
+            self._send_json(404, {"error": "not found"})
+            return
+        if self.path == "/api/chat" and json.loads(body or b"{}").get("messages") == []:
+            # Ollama answers a request without messages by loading the model.
+            self._send_json(200, {"model": "mock", "done": True, "done_reason": "load", "load_duration": 0})
+            return
+        cfg = self.config
+        if cfg["latency_ms"]:
+            time.sleep(cfg["latency_ms"] / 1000)
+        if cfg["fail_rate"] and self.rng.random() < cfg["fail_rate"]:
+            self._send_json(cfg["fail_status"], {"error": {"message": "injected failure"}})
+            return
+
+        content_type, events = route
+        tokens = cfg["tokens"]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._stream(events(self._texts(tokens)))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _texts(self, tokens: int):
+        step = max(1, self.config["chunk_tokens"])
+        for start in range(0, tokens, step):
+            yield "".join(_token(i) for i in range(start, min(tokens, start + step)))
+
+    def _stream(self, events):
+        cfg = self.config
+        step = max(1, cfg["chunk_tokens"])
+        interval = step / cfg["token_rate"] if cfg["token_rate"] else 0
+        drop_after = cfg["drop_after"]
+        sent = 0
+        batch = []
+        next_at = time.perf_counter()
+        for event in events:
+            batch.append(event.encode("utf-8"))
+            sent += step
+            if drop_after and sent >= drop_after:
+                self._write_chunk(b"".join(batch))
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            if interval:
+                self._write_chunk(b"".join(batch))
+                batch.clear()
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            elif len(batch) >= 64:
+                # Unthrottled mode still sends many small events per write,
+                # like a fast local model behind a buffered socket.
+                self._write_chunk(b"".join(batch))
+                batch.clear()
+        if batch:
+            self._write_chunk(b"".join(batch))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(config: dict = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    cfg = dict(DEFAULT_CONFIG)
+    cfg.update(config or {})
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": cfg, "rng": random.Random(cfg["seed"])})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(config: dict = None):
+    server = make_server(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _serve(config, port_queue):
+    server = make_server(config)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_in_process(config: dict = None):
+    # A separate process keeps the server off the client's GIL, so client
+    # parse throughput is measured rather than the two sharing one core.
+    ctx = multiprocessing.get_context("spawn")
+    port_queue = ctx.Queue()
+    proc = ctx.Process(target=_serve, args=(config, port_queue), daemon=True)
+    proc.start()
+    port = port_queue.get(timeout=30)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve mock Ollama/OpenAI/Anthropic streaming endpoints")
+    parser.add_argument("--port", type=int, default=11435)
+    for key, value in DEFAULT_CONFIG.items():
+        if key == "seed":
+            continue
+        parser.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    args = parser.parse_args()
+    config = {k: getattr(args, k) for k in DEFAULT_CONFIG if k != "seed"}
+    server = make_server(config, port=args.port)
+    print(f"Mock providers on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from db import configure_connection
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+
+def make_key(provider: str, model: str, temperature: float, max_tokens: int, messages: List[Dict]) -> str:
+    # messages must already include the system prompt (and any summary) so
+    # that changing either produces a different key.
+    blob = json.dumps(
+        [provider, model, float(temperature), int(max_tokens), messages],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+# Two-tier cache of complete responses: an in-memory LRU in front of a
+# SQLite table bounded by entry count, total size and age. Safe to share
+# between the UI thread and stream workers.
+class ResponseCache:
+    def __init__(self, path: str, memory_entries: int = 256, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        configure_connection(self.conn)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache (created_at)")
+        self.conn.commit()
+        # Running totals of the table, so put() need not sum it every time.
+        self._entries, self._bytes = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+        ).fetchone()
+
+    def configure(self, memory_entries: int, max_entries: int, max_bytes: int, ttl_seconds: float):
+        # New limits from saved settings; a smaller cache shrinks right away.
+        with self._lock:
+            self.memory_entries = memory_entries
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.ttl_seconds = ttl_seconds
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+            self._evict(time.time())
+            self.conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry[0]
+            row = self.conn.execute(
+                "SELECT response, created_at FROM response_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            self.conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self._remember(key, row[0], row[1])
+            self._counters["disk_hits"] += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            row = self.conn.execute("SELECT size FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._entries -= 1
+                self._bytes -= row[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._entries += 1
+            self._bytes += size
+            self._evict(now)
+            self.conn.commit()
+            self._remember(key, response, now)
+            self._counters["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.conn.execute("DELETE FROM response_cache")
+            self.conn.commit()
+            self._entries = self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            entries, total = self._entries, self._bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self._memory)
+        stats["disk_entries"] = entries
+        stats["disk_bytes"] = total
+        return stats
+
+    def _remember(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        # Expired rows first, then least recently used ones until both the
+        # entry and byte limits hold. Evicted keys leave the memory tier too.
+        doomed = self.conn.execute(
+            "SELECT key, size FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).fetchall()
+        entries = self._entries - len(doomed)
+        total = self._bytes - sum(size for _, size in doomed)
+        if entries > self.max_entries or total > self.max_bytes:
+            expired = {key for key, _ in doomed}
+            for key, size in self.conn.execute("SELECT key, size FROM response_cache ORDER BY last_used"):
+                if entries <= self.max_entries and total <= self.max_bytes:
+                    break
+                if key in expired:
+                    continue
+                doomed.append((key, size))
+                entries -= 1
+                total -= size
+        if not doomed:
+            return
+        self.conn.executemany("DELETE FROM response_cache WHERE key = ?", [(key,) for key, _ in doomed])
+        self._entries, self._bytes = entries, total
+        self._counters["evictions"] += len(doomed)
+        for key, _ in doomed:
+            self._memory.pop(key, None)
+
+
+def get_cache(path: str, **config) -> ResponseCache:
+    # One cache per file, shared by every LLMClient that points at it. A
+    # client built after a settings change brings the new limits along.
+    with _registry_lock:
+        cache = _registry.get(path)
+        if cache is None:
+            cache = ResponseCache(path, **config)
+            _registry[path] = cache
+        else:
+            limits = dict(_limits(cache), **config)
+            if limits != _limits(cache):
+                cache.configure(**limits)
+        return cache
+
+
+def _limits(cache: ResponseCache) -> Dict:
+    return {
+        "memory_entries": cache.memory_entries,
+        "max_entries": cache.max_entries,
+        "max_bytes": cache.max_bytes,
+        "ttl_seconds": cache.ttl_seconds,
+    }
@@ -0,0 +1,40 @@
+from typing import Dict, List
+
+DEFAULT_CONTEXT_LIMIT = 8192
+# Role markers and separators each provider wraps around a message.
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text with BPE tokenizers.
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD
+
+
+def context_limit(settings: dict, model: str) -> int:
+    limits = settings.get("context_limits", {})
+    return int(limits.get(model, settings.get("context_limit", DEFAULT_CONTEXT_LIMIT)))
+
+
+def build_context(db, session_id: str, budget: int, page_size: int = 64, after_id: int = 0) -> List[Dict]:
+    # Walk the session newest-first and stop as soon as the budget is spent,
+    # so the cost depends on the turns kept rather than the session length.
+    kept = []
+    used = 0
+    backfill = []
+    for row in db.iter_messages_reverse(session_id, page_size, after_id):
+        cost = row["token_count"]
+        if cost is None:
+            cost = estimate_tokens(row["content"])
+            backfill.append((cost, row["id"]))
+        if kept and used + cost > budget:
+            break
+        kept.append(row)
+        used += cost
+    if backfill:
+        db.set_token_counts(backfill)
+
+    kept.reverse()
+    # Providers expect the conversation to open with a user turn.
+    while len(kept) > 1 and kept[0]["role"] == "assistant":
+        kept.pop(0)
+    return [{"role": r["role"], "content": r["content"]} for r in kept]
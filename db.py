@@ -1,13 +1,33 @@
 
+import atexit
+import html
+import logging
+import queue
 import sqlite3
+import threading
 import uuid
 import datetime
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+
+from context import estimate_tokens
+
+log = logging.getLogger("localai.db")
 
 def utc_now_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
-def ensure_schema(conn):
-    cur = conn.cursor()
+def configure_connection(conn):
+    # WAL lets readers proceed while a write is in flight; NORMAL sync is
+    # durable across application crashes and only loses the tail on power loss.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA busy_timeout = 5000")
+
+def _create_base_tables(cur):
     cur.execute("""
         CREATE TABLE IF NOT EXISTS sessions (
             id TEXT PRIMARY KEY,
@@ -24,39 +44,649 @@ def ensure_schema(conn):
             FOREIGN KEY (session_id) REFERENCES sessions(id)
         )
     """)
-    conn.commit()
+
+def _add_token_count(cur):
+    columns = {r[1] for r in cur.execute("PRAGMA table_info(messages)")}
+    if "token_count" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+
+def _create_summaries(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            session_id TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            upto_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    """)
+
+def _index_messages_by_session(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)")
+
+def _create_fts_index(cur):
+    # External-content FTS5 table over messages.content, kept in sync by
+    # triggers and backfilled from existing rows.
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cur.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def fts_query(text: str) -> str:
+    # Quote every term so user input cannot inject FTS5 syntax. A trailing *
+    # still asks for a prefix match; it is opt-in because short prefixes can
+    # match most of the index.
+    terms = []
+    for t in text.split():
+        prefix = t.endswith("*") and len(t) > 1
+        t = t.rstrip("*")
+        if t:
+            terms.append('"' + t.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def _add_truncated_flag(cur):
+    columns = {r[1] for r in cur.execute("PRAGMA table_info(messages)")}
+    if "truncated" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN truncated INTEGER NOT NULL DEFAULT 0")
+
+def _create_metrics(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            session_id TEXT,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            status TEXT NOT NULL,
+            cache_hit INTEGER NOT NULL DEFAULT 0,
+            connect_ms REAL,
+            ttft_ms REAL,
+            total_ms REAL,
+            chunks INTEGER NOT NULL,
+            tokens INTEGER NOT NULL,
+            tokens_per_sec REAL,
+            gap_histogram TEXT NOT NULL,
+            ui_flush_p50_ms REAL,
+            ui_flush_max_ms REAL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_metrics_provider_model ON metrics (provider, model, id)")
+
+def _add_provider_timings(cur):
+    columns = {r[1] for r in cur.execute("PRAGMA table_info(metrics)")}
+    for name, kind in (("prompt_tokens", "INTEGER"), ("load_ms", "REAL"), ("prompt_eval_ms", "REAL"), ("eval_ms", "REAL")):
+        if name not in columns:
+            cur.execute(f"ALTER TABLE metrics ADD COLUMN {name} {kind}")
+
+def _create_embeddings(cur):
+    # One float32 vector per message for semantic memory (see memory.py).
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            message_id INTEGER PRIMARY KEY,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            FOREIGN KEY (message_id) REFERENCES messages(id)
+        )
+    """)
+
+def _add_message_model(cur):
+    # Which model wrote an assistant message; NULL for older rows.
+    columns = {r[1] for r in cur.execute("PRAGMA table_info(messages)")}
+    if "model" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN model TEXT")
+
+def _create_session_imports(cur):
+    # Sessions created by archive.import_messages. complete = 0 while the
+    # import is still adding messages, so one interrupted by a crash can be
+    # picked up again by importing the same file.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS session_imports (
+            session_id TEXT PRIMARY KEY,
+            complete INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+# Applied in order; PRAGMA user_version records how many have run. Steps are
+# idempotent because databases created before versioning already have some
+# of these objects at user_version 0.
+MIGRATIONS = [
+    _create_base_tables,
+    _add_token_count,
+    _create_summaries,
+    _index_messages_by_session,
+    _create_fts_index,
+    _add_truncated_flag,
+    _create_metrics,
+    _add_provider_timings,
+    _create_embeddings,
+    _add_message_model,
+    _create_session_imports,
+]
+
+def ensure_schema(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        try:
+            migrate(cur)
+            cur.execute(f"PRAGMA user_version = {number}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def migrate(path: str):
+    # Brings the schema up to date on a short-lived connection, so a slow
+    # migration can run on a worker thread before the app opens its own.
+    conn = sqlite3.connect(path)
+    try:
+        configure_connection(conn)
+        ensure_schema(conn)
+    finally:
+        conn.close()
+
+class DatabaseWriter(threading.Thread):
+    # The only thread that writes to the database. Jobs, fn(conn, *args),
+    # queued from any thread run in order; everything already waiting when
+    # the writer wakes up goes into one transaction (group commit), so many
+    # writers share one fsync instead of queueing on the write lock. Each
+    # job runs in a savepoint, so a failing job rolls back alone and fails
+    # only its own future. Futures resolve once the transaction commits.
+    def __init__(self, path: str, max_batch: int = 256):
+        super().__init__(name="db-writer", daemon=True)
+        self.path = path
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.start()
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("the database writer is closed")
+            self._queue.put((fn, args, future))
+        return future
+
+    def close(self):
+        # Commits everything queued so far, then stops the thread.
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+        self.join()
+
+    def run(self):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        configure_connection(conn)
+        try:
+            while True:
+                jobs = [self._queue.get()]
+                while jobs[-1] is not None and len(jobs) < self.max_batch:
+                    try:
+                        jobs.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = jobs[-1] is None
+                if stop:
+                    jobs.pop()
+                if jobs:
+                    self._apply(conn, jobs)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _apply(self, conn, jobs):
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            for _, _, future in jobs:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+        for fn, args, future in jobs:
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute("SAVEPOINT job")
+            try:
+                result = fn(conn, *args)
+            except BaseException as e:
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                future.set_exception(e)
+                continue
+            conn.execute("RELEASE job")
+            done.append((future, result))
+        try:
+            conn.execute("COMMIT")
+        except Exception as e:
+            # Some errors roll the transaction back by themselves.
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        for future, result in done:
+            future.set_result(result)
+
+class ReadPool:
+    # Read-only connections shared by every thread, opened on demand up to
+    # `size`. In WAL mode readers never wait for the writer or each other.
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("the database is closed")
+                if len(self._all) < self.size:
+                    conn = sqlite3.connect(self.path, check_same_thread=False)
+                    conn.row_factory = sqlite3.Row
+                    configure_connection(conn)
+                    conn.execute("PRAGMA query_only = ON")
+                    self._all.append(conn)
+            if conn is None:
+                conn = self._idle.get()
+        if conn is None:
+            # close() leaves None behind to wake anyone waiting for a connection.
+            self._idle.put(None)
+            raise sqlite3.ProgrammingError("the database is closed")
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if not self._closed:
+                    self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+            while not self._idle.empty():
+                self._idle.get_nowait()
+            self._idle.put(None)
 
 class Database:
-    def __init__(self, path: str = "chat_history.db"):
-        self.conn = sqlite3.connect(path)
-        self.conn.row_factory = sqlite3.Row
-        ensure_schema(self.conn)
-
-    def start_new_session(self) -> str:
-        session_id = str(uuid.uuid4())
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO sessions (id, created_at) VALUES (?, ?)",
-            (session_id, utc_now_iso())
-        )
-        self.conn.commit()
+    # Thread-safe access to the chat history. Writes are queued to one
+    # DatabaseWriter and return a Future instead of blocking the caller;
+    # reads use a ReadPool. A read of one session first waits for the
+    # calling thread's queued writes to that session, so code that writes
+    # and then reads sees its writes; other reads never wait on the writer.
+    def __init__(self, path: str = "chat_history.db", readers: int = 4):
+        self.path = path
+        conn = sqlite3.connect(path)
+        try:
+            configure_connection(conn)
+            ensure_schema(conn)
+        finally:
+            conn.close()
+        self.writer = DatabaseWriter(path)
+        self.readers = ReadPool(path, readers)
+        self._local = threading.local()
+        self._listeners = []
+        self._error_handlers = []
+        self._closed = False
+        atexit.register(self.close)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.writer.close()
+        self.readers.close()
+
+    def add_listener(self, callback):
+        # callback(message_id, session_id, role, content), called after each
+        # add_message commits, on the writer thread; it must not block.
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def add_error_handler(self, callback):
+        # callback(sqlite3.Error) for writes that failed; on the writer thread.
+        self._error_handlers.append(callback)
+
+    def write(self, fn, *args) -> Future:
+        # Runs fn(conn, *args) on the writer thread inside a transaction.
+        # Inside batch() the job joins the batch instead. Reads do not wait
+        # for these jobs; use the future to know when one has committed.
+        return self._write(fn, args, ())
+
+    def _write(self, fn, args, sessions) -> Future:
+        # sessions: the session ids the job writes to, whose reads on this
+        # thread must wait for it.
+        jobs = getattr(self._local, "batch", None)
+        if jobs is not None:
+            future = Future()
+            jobs.append((fn, args, future, sessions))
+            return future
+        future = self.writer.submit(fn, *args)
+        future.add_done_callback(self._report)
+        self._local.last_write = future
+        if sessions:
+            pending = self._pending()
+            if len(pending) > 64:
+                for key in [k for k, f in pending.items() if f.done()]:
+                    del pending[key]
+            for session_id in sessions:
+                pending[session_id] = future
+        return future
+
+    def _pending(self):
+        # Last queued write per session, for this thread.
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def _report(self, future: Future):
+        # Only database errors; anything else a job raises is for its caller.
+        if future.cancelled() or not isinstance(future.exception(), sqlite3.Error):
+            return
+        log.error("database write failed: %s", future.exception())
+        for callback in self._error_handlers:
+            callback(future.exception())
+
+    def flush(self):
+        # Waits until this thread's queued writes have committed.
+        last = getattr(self._local, "last_write", None)
+        if last is not None and not last.done():
+            wait([last])
+
+    @contextmanager
+    def _read(self, session_id: str = None):
+        if session_id is not None:
+            last = self._pending().get(session_id)
+            if last is not None and not last.done():
+                wait([last])
+        with self.readers.connection() as conn:
+            yield conn
+
+    @contextmanager
+    def batch(self):
+        # Collects this thread's writes and commits them as one job on exit,
+        # so they land together or not at all; if the block raises they are
+        # dropped. Reads inside the batch do not see its writes yet.
+        if getattr(self._local, "batch", None) is not None:
+            yield self
+            return
+        self._local.batch = jobs = []
+        try:
+            yield self
+        except BaseException:
+            for _, _, future, _ in jobs:
+                future.cancel()
+            raise
+        finally:
+            self._local.batch = None
+        if jobs:
+            sessions = {s for _, _, _, job_sessions in jobs for s in job_sessions}
+            self._write(_run_batch, (jobs,), sessions).add_done_callback(lambda f: _settle_batch(jobs, f))
+
+    def start_new_session(self, session_id: str = None) -> str:
+        session_id = session_id or str(uuid.uuid4())
+        self._write(_insert_session, (session_id, utc_now_iso()), (session_id,))
         return session_id
 
-    def add_message(self, session_id: str, role: str, content: str):
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
-            (session_id, role, content, utc_now_iso())
-        )
-        self.conn.commit()
+    def session_exists(self, session_id: str) -> bool:
+        with self._read(session_id) as conn:
+            return conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def add_message(self, session_id: str, role: str, content: str, truncated: bool = False,
+                    model: str = None) -> Future:
+        # Resolves to the new message id.
+        row = (session_id, role, content, utc_now_iso(), estimate_tokens(content), int(truncated), model)
+        future = self._write(_insert_message, (row,), (session_id,))
+        if self._listeners:
+            def notify(f):
+                if not f.cancelled() and f.exception() is None:
+                    for callback in self._listeners:
+                        callback(f.result(), session_id, role, content)
+            future.add_done_callback(notify)
+        return future
+
+    def add_exchange(self, session_id: str, messages, reply: str = None, truncated: bool = False,
+                     model: str = None, append: bool = True) -> Future:
+        # Records one request and its reply as a single writer job, which
+        # decides inside the transaction whether the session is new: a new
+        # session gets every user and assistant turn of `messages`, an
+        # existing one only the latest user turn (or nothing if append is
+        # False). Resolves to (message id, row) for each message added.
+        now = utc_now_iso()
+        turns = [(m["role"], m["content"], now, estimate_tokens(m["content"]), 0, None)
+                 for m in messages if m.get("role") in ("user", "assistant")]
+        latest = next((t for t in reversed(turns) if t[0] == "user"), None)
+        if reply:
+            reply = ("assistant", reply, now, estimate_tokens(reply), int(truncated), model)
+        future = self._write(_insert_exchange, (session_id, now, turns, latest, reply, append), (session_id,))
+        if self._listeners:
+            def notify(f):
+                if not f.cancelled() and f.exception() is None:
+                    for message_id, row in f.result():
+                        for callback in self._listeners:
+                            callback(message_id, session_id, row[0], row[1])
+            future.add_done_callback(notify)
+        return future
+
+    def add_messages(self, rows) -> Future:
+        # rows: iterable of (session_id, role, content) or
+        # (session_id, role, content, created_at) tuples, written in one
+        # transaction. Materialized here, on the caller's thread.
+        now = utc_now_iso()
+        params = [
+            (r[0], r[1], r[2], r[3] if len(r) > 3 else now, estimate_tokens(r[2]))
+            for r in rows
+        ]
+        return self._write(_insert_messages, (params,), {p[0] for p in params})
 
     def get_messages(self, session_id: str, as_openai_format: bool = False):
-        cur = self.conn.cursor()
-        cur.execute(
-            "SELECT role, content, created_at FROM messages WHERE session_id = ? ORDER BY id",
-            (session_id,)
-        )
-        rows = cur.fetchall()
+        with self._read(session_id) as conn:
+            rows = conn.execute(
+                "SELECT role, content, created_at FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
         if as_openai_format:
             return [{"role": r["role"], "content": r["content"]} for r in rows]
         return [dict(r) for r in rows]
+
+    def get_messages_page(self, session_id: str, before_id: int = None, after_id: int = None, limit: int = 50):
+        # Keyset pagination over (session_id, id). With no cursor the newest
+        # page is returned; pages are always in ascending id order.
+        cols = "SELECT id, role, content, created_at, truncated, model FROM messages WHERE session_id = ?"
+        with self._read(session_id) as conn:
+            if after_id is not None:
+                rows = conn.execute(cols + " AND id > ? ORDER BY id LIMIT ?", (session_id, after_id, limit))
+                return [dict(r) for r in rows.fetchall()]
+            if before_id is not None:
+                rows = conn.execute(cols + " AND id < ? ORDER BY id DESC LIMIT ?", (session_id, before_id, limit))
+            else:
+                rows = conn.execute(cols + " ORDER BY id DESC LIMIT ?", (session_id, limit))
+            rows = [dict(r) for r in rows.fetchall()]
+        rows.reverse()
+        return rows
+
+    def iter_messages_reverse(self, session_id: str, page_size: int = 64, after_id: int = 0):
+        # One pooled connection per page, not held while the caller consumes it.
+        before_id = None
+        while True:
+            with self._read(session_id) as conn:
+                if before_id is None:
+                    rows = conn.execute(
+                        "SELECT id, role, content, token_count FROM messages WHERE session_id = ? AND id > ? "
+                        "ORDER BY id DESC LIMIT ?",
+                        (session_id, after_id, page_size)
+                    ).fetchall()
+                else:
+                    rows = conn.execute(
+                        "SELECT id, role, content, token_count FROM messages WHERE session_id = ? AND id > ? "
+                        "AND id < ? ORDER BY id DESC LIMIT ?",
+                        (session_id, after_id, before_id, page_size)
+                    ).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            before_id = rows[-1]["id"]
+
+    def set_token_counts(self, counts) -> Future:
+        return self.write(_update_token_counts, list(counts))
+
+    def get_summary(self, session_id: str):
+        with self._read(session_id) as conn:
+            row = conn.execute(
+                "SELECT content, upto_id, updated_at FROM summaries WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save_summary(self, session_id: str, content: str, upto_id: int) -> Future:
+        return self._write(_upsert_summary, (session_id, content, upto_id, utc_now_iso()), (session_id,))
+
+    def unsummarized_messages(self, session_id: str, keep_recent: int, limit: int):
+        # Turns after the stored summary, leaving the newest keep_recent
+        # messages to be sent verbatim.
+        summary = self.get_summary(session_id)
+        after_id = summary["upto_id"] if summary else 0
+        with self._read(session_id) as conn:
+            row = conn.execute(
+                "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (session_id, keep_recent)
+            ).fetchone()
+            if row is None:
+                return []
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? AND id <= ? "
+                "ORDER BY id LIMIT ?",
+                (session_id, after_id, row["id"], limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def search(self, query: str, limit: int = 20, offset: int = 0):
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT m.id, m.session_id, m.role, m.created_at, "
+                "snippet(messages_fts, 0, char(2), char(3), '…', 16) AS snippet, "
+                "bm25(messages_fts) AS rank "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                (match, limit, offset)
+            ).fetchall()
+        results = []
+        for r in rows:
+            row = dict(r)
+            row["snippet"] = html.escape(row["snippet"]).replace("\x02", "<b>").replace("\x03", "</b>")
+            results.append(row)
+        return results
+
+    def add_metrics(self, row: dict) -> Future:
+        return self.write(_insert_metrics, dict(row, created_at=utc_now_iso()))
+
+    def recent_metrics(self, limit: int = 5000):
+        with self._read() as conn:
+            rows = conn.execute("SELECT * FROM metrics ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+# Writer jobs: fn(conn, *args), run on the DatabaseWriter thread.
+def _run_batch(conn, jobs):
+    return [fn(conn, *args) for fn, args, _, _ in jobs]
+
+def _settle_batch(jobs, future: Future):
+    # The batch's own future resolves after the commit; only then do the
+    # futures handed out inside the batch.
+    if future.cancelled() or future.exception() is not None:
+        error = sqlite3.OperationalError("batch cancelled") if future.cancelled() else future.exception()
+        for _, _, inner, _ in jobs:
+            inner.set_exception(error)
+        return
+    for (_, _, inner, _), result in zip(jobs, future.result()):
+        inner.set_result(result)
+
+def _insert_session(conn, session_id, created_at):
+    conn.execute("INSERT INTO sessions (id, created_at) VALUES (?, ?)", (session_id, created_at))
+
+def _insert_message(conn, row):
+    cur = conn.execute(
+        "INSERT INTO messages (session_id, role, content, created_at, token_count, truncated, model) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        row
+    )
+    return cur.lastrowid
+
+def _insert_exchange(conn, session_id, created_at, turns, latest, reply, append):
+    cur = conn.execute("INSERT OR IGNORE INTO sessions (id, created_at) VALUES (?, ?)", (session_id, created_at))
+    if cur.rowcount == 0:
+        if not append:
+            return []
+        turns = [latest] if latest else []
+    added = []
+    for row in turns + ([reply] if reply else []):
+        cur = conn.execute(
+            "INSERT INTO messages (session_id, role, content, created_at, token_count, truncated, model) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id,) + row
+        )
+        added.append((cur.lastrowid, row))
+    return added
+
+def _insert_messages(conn, params):
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content, created_at, token_count) VALUES (?, ?, ?, ?, ?)",
+        params
+    )
+
+def _update_token_counts(conn, counts):
+    conn.executemany("UPDATE messages SET token_count = ? WHERE id = ?", counts)
+
+def _upsert_summary(conn, session_id, content, upto_id, updated_at):
+    conn.execute(
+        "INSERT INTO summaries (session_id, content, upto_id, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(session_id) DO UPDATE SET content = excluded.content, "
+        "upto_id = excluded.upto_id, updated_at = excluded.updated_at",
+        (session_id, content, upto_id, updated_at)
+    )
+
+def _insert_metrics(conn, row):
+    cols = ", ".join(row)
+    marks = ", ".join("?" for _ in row)
+    conn.execute(f"INSERT INTO metrics ({cols}) VALUES ({marks})", tuple(row.values()))
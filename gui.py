@@ -1,39 +1,418 @@
 
+import html
 import json
+import logging
+import threading
+import time
 from pathlib import Path
-from PyQt6.QtCore import QThread, pyqtSignal
-from PyQt6.QtGui import QAction, QIcon
+from PyQt6.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QAction, QIcon, QTextCharFormat, QTextCursor
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QTextEdit, QLineEdit, QPushButton,
-    QFileDialog, QMessageBox, QHBoxLayout, QLabel, QDialog, QFormLayout, QComboBox
+    QFileDialog, QMessageBox, QHBoxLayout, QLabel, QDialog, QFormLayout, QComboBox,
+    QListWidget, QListWidgetItem, QTableWidget, QTableWidgetItem, QProgressDialog
 )
 
-from llm_client import LLMClient
-from db import ensure_schema
+from db import Database, migrate
+from context import build_context, estimate_tokens
+from summarizer import summarize
+from metrics import StreamMetrics, summarize_rows
 
 ASSETS = Path(__file__).resolve().parent / "assets"
 
+TRUNCATED_MARKER = "&nbsp;<i>[stopped]</i>"
+
+log = logging.getLogger("localai.gui")
+
+def chat_message_html(role: str, content: str, truncated: bool = False) -> str:
+    if role == "user":
+        return f"<p><b>You:</b> {content}</p>"
+    marker = TRUNCATED_MARKER if truncated else ""
+    return f"<p><b>Assistant:</b> {content}{marker}</p>"
+
+def history_line_html(m: dict) -> str:
+    role = f"{m['role']} ({m['model']})" if m.get("model") else m["role"]
+    text = html.escape(f"[{m['created_at']}] {role}: {m['content']}").replace("\n", "<br>")
+    return f"<p>{text}</p>"
+
+class PagedTextView(QTextEdit):
+    # Shows the newest page of a session and prepends older pages when the
+    # user scrolls to the top, so open time and memory follow the page size.
+    def __init__(self, db, render, page_size: int = 100, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.db = db
+        self.render = render
+        self.page_size = page_size
+        self.session_id = None
+        self.oldest_id = None
+        self.has_older = False
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+
+    def load(self, session_id: str):
+        self.clear()
+        self.session_id = session_id
+        rows = self.db.get_messages_page(session_id, limit=self.page_size)
+        self._track(rows)
+        for r in rows:
+            self.append(self.render(r))
+        bar = self.verticalScrollBar()
+        bar.setValue(bar.maximum())
+        QTimer.singleShot(0, self._fill_viewport)
+
+    def load_older(self):
+        if not self.has_older:
+            return
+        rows = self.db.get_messages_page(self.session_id, before_id=self.oldest_id, limit=self.page_size)
+        self._track(rows)
+        if not rows:
+            return
+        bar = self.verticalScrollBar()
+        from_bottom = bar.maximum() - bar.value()
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.MoveOperation.Start)
+        cursor.insertHtml("".join(self.render(r) for r in rows))
+        cursor.insertBlock()
+        bar.setValue(bar.maximum() - from_bottom)
+
+    def _track(self, rows: list):
+        self.has_older = len(rows) == self.page_size
+        if rows:
+            self.oldest_id = rows[0]["id"]
+
+    def _fill_viewport(self):
+        # A first page shorter than the viewport has no scrollbar to drag up.
+        while self.has_older and self.verticalScrollBar().maximum() == 0:
+            self.load_older()
+
+    def _on_scroll(self, value: int):
+        if value == self.verticalScrollBar().minimum() and self.has_older:
+            self.load_older()
+
+class StreamRenderer(QObject):
+    # Buffers streamed chunks and writes them into the active assistant
+    # block at a fixed frame rate through a cursor kept on that block, so
+    # each flush costs O(chunk) regardless of how long the document is.
+    def __init__(self, view: QTextEdit, interval_ms: int = 16, parent=None):
+        super().__init__(parent)
+        self.view = view
+        self.buffer = []
+        self.cursor = None
+        self.metrics = None
+        self.pending_since = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.flush)
+
+    def feed(self, text: str, emitted_at: float = None):
+        if self.cursor is None:
+            self._begin()
+        if not self.buffer:
+            self.pending_since = emitted_at if emitted_at is not None else time.perf_counter()
+        self.buffer.append(text)
+
+    def _begin(self):
+        self.view.append(chat_message_html("assistant", ""))
+        self.cursor = QTextCursor(self.view.document())
+        self.cursor.movePosition(QTextCursor.MoveOperation.End)
+        self.cursor.setCharFormat(QTextCharFormat())
+        self.timer.start()
+
+    def flush(self):
+        if not self.buffer or self.cursor is None:
+            return
+        text = "".join(self.buffer)
+        self.buffer.clear()
+        bar = self.view.verticalScrollBar()
+        follow = bar.value() >= bar.maximum() - 4
+        self.cursor.insertText(text)
+        if follow:
+            bar.setValue(bar.maximum())
+        if self.metrics is not None:
+            # From the oldest buffered chunk leaving the worker to it being on screen.
+            self.metrics.mark_flush(time.perf_counter() - self.pending_since)
+
+    def finish(self, marker_html: str = ""):
+        self.flush()
+        self.timer.stop()
+        if marker_html and self.cursor is not None:
+            self.cursor.insertHtml(marker_html)
+        self.cursor = None
+
 class StreamWorker(QThread):
-    chunk = pyqtSignal(str)
+    chunk = pyqtSignal(str, float)
     done = pyqtSignal(str)
+    cancelled = pyqtSignal(str)
     error = pyqtSignal(str)
 
-    def __init__(self, client, session_id: str, messages: list, parent=None):
+    def __init__(self, client, session_id: str, messages: list, summary=None, recall: bool = False, parent=None):
         super().__init__(parent)
         self.client = client
         self.session_id = session_id
         self.messages = messages
+        self.summary = summary
+        self.recall = recall
+        from llm_client import CancelToken
+        self.cancel_token = CancelToken()
+        self.metrics = StreamMetrics(client.mode, client.model, session_id)
+
+    def stop(self):
+        self.cancel_token.cancel()
+
+    def run(self):
+        parts = []
+        try:
+            for piece in self.client.stream_chat(self.messages, session_id=self.session_id,
+                                                 summary=self.summary, cancel=self.cancel_token,
+                                                 metrics=self.metrics, recall=self.recall):
+                parts.append(piece)
+                self.chunk.emit(piece, time.perf_counter())
+        except Exception as e:
+            if not self.cancel_token.cancelled:
+                self.error.emit(str(e))
+                return
+        if self.cancel_token.cancelled:
+            self.cancelled.emit("".join(parts))
+        else:
+            self.done.emit("".join(parts))
+
+class WarmUpWorker(QObject):
+    # A plain daemon thread rather than a QThread: loading a large model can
+    # take minutes and must not hold up closing the window. It builds its own
+    # client, so the provider modules are imported on this thread rather
+    # than the UI thread.
+    done = pyqtSignal(str, float)
+    error = pyqtSignal(str)
+
+    def __init__(self, settings: dict, parent=None):
+        super().__init__(parent)
+        self.settings = settings
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        try:
+            from llm_client import LLMClient
+            client = LLMClient(self.settings, None)
+            load_ms = client.warm_up()
+            self.done.emit(client.offline_model, load_ms or 0.0)
+        except Exception as e:
+            self.error.emit(str(e))
+
+class ArchiveWorker(QThread):
+    # Runs archive.export_messages, which reads through a connection of its
+    # own, or archive.import_messages, which hands chunks to the writer
+    # thread, and reports progress as (done, total).
+    progress = pyqtSignal(int, int)
+    done = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        import archive
+        try:
+            self.done.emit(self.job(self.progress.emit, self.stop_event))
+        except archive.Cancelled:
+            self.done.emit("")
+        except Exception as e:
+            self.error.emit(str(e))
+
+class WriteErrors(QObject):
+    # Database error handlers run on the writer thread; the signal carries
+    # the failure over to the GUI thread.
+    failed = pyqtSignal(str)
+
+    def __call__(self, error: Exception):
+        self.failed.emit(f"{type(error).__name__}: {error}")
+
+class DatabaseLoader(QThread):
+    # Runs pending migrations (an FTS backfill can take seconds on a large
+    # history) off the UI thread; the window opens its own connection after.
+    ready = pyqtSignal()
+    error = pyqtSignal(str)
+
+    def __init__(self, path: str, parent=None):
+        super().__init__(parent)
+        self.path = path
 
     def run(self):
         try:
-            full_text = ""
-            for piece in self.client.stream_chat(self.messages, session_id=self.session_id):
-                full_text += piece
-                self.chunk.emit(piece)
-            self.done.emit(full_text)
+            migrate(self.path)
+            self.ready.emit()
         except Exception as e:
             self.error.emit(str(e))
 
+class SummarizeWorker(QThread):
+    done = pyqtSignal(str, str, int)
+    error = pyqtSignal(str)
+
+    def __init__(self, client, session_id: str, previous, turns: list, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.session_id = session_id
+        self.previous = previous
+        self.turns = turns
+
+    def run(self):
+        try:
+            text = summarize(self.client, self.session_id, self.previous, self.turns)
+            if text:
+                self.done.emit(self.session_id, text, self.turns[-1]["id"])
+        except Exception as e:
+            self.error.emit(str(e))
+
+class ComparePane(QWidget):
+    # One target's answer in CompareDialog, with its timings underneath.
+    def __init__(self, title: str, interval_ms: int, parent=None):
+        super().__init__(parent)
+        self.title = QLabel(f"<b>{html.escape(title)}</b>")
+        self.view = QTextEdit()
+        self.view.setReadOnly(True)
+        self.stats = QLabel("")
+        self.renderer = StreamRenderer(self.view, interval_ms, self)
+        lay = QVBoxLayout(self)
+        lay.setContentsMargins(0, 0, 0, 0)
+        lay.addWidget(self.title)
+        lay.addWidget(self.view)
+        lay.addWidget(self.stats)
+
+class CompareDialog(QDialog):
+    # Streams one prompt to every target in compare_targets at once, one
+    # StreamWorker per pane, so the wait is the slowest model's time rather
+    # than the sum. Each prompt is stored as its own session: the question
+    # once, then every answer tagged with the model that wrote it.
+    def __init__(self, settings: dict, db, parent=None):
+        super().__init__(parent)
+        from llm_client import MODEL_SETTINGS, LLMClient, settings_with
+        self.setWindowTitle("Compare Models")
+        self.resize(1200, 600)
+        self.db = db
+        self.workers = []
+        self.started = None
+        self.session_id = None
+
+        # No failover here: each pane must be answered by its own model.
+        targets = settings.get("compare_targets") or [{"mode": m} for m in MODEL_SETTINGS]
+        self.clients = [
+            LLMClient(settings_with(settings, t.get("mode"), t.get("model"), failover_enabled=False), db)
+            for t in targets
+        ]
+        interval = settings.get("render_interval_ms", 16)
+        self.panes = [ComparePane(f"{c.mode}: {c.model}", interval, self) for c in self.clients]
+
+        self.prompt = QLineEdit()
+        self.prompt.setPlaceholderText("Ask every model...")
+        self.send_btn = QPushButton("Send")
+        self.stop_btn = QPushButton("Stop")
+        self.stop_btn.setShortcut("Esc")
+        self.stop_btn.setEnabled(False)
+        row = QHBoxLayout()
+        row.addWidget(self.prompt)
+        row.addWidget(self.send_btn)
+        row.addWidget(self.stop_btn)
+        panes = QHBoxLayout()
+        for pane in self.panes:
+            panes.addWidget(pane)
+        self.status = QLabel("")
+        lay = QVBoxLayout(self)
+        lay.addLayout(row)
+        lay.addLayout(panes)
+        lay.addWidget(self.status)
+
+        self.send_btn.clicked.connect(self.on_send)
+        self.prompt.returnPressed.connect(self.on_send)
+        self.stop_btn.clicked.connect(self.on_stop)
+
+    def is_running(self) -> bool:
+        return any(w.isRunning() for w in self.workers)
+
+    def on_send(self):
+        text = self.prompt.text().strip()
+        if not text or self.is_running():
+            return
+        self.session_id = self.db.start_new_session()
+        self.db.add_message(self.session_id, "user", text)
+        messages = [{"role": "user", "content": text}]
+        self.workers = []
+        for client, pane in zip(self.clients, self.panes):
+            pane.view.clear()
+            pane.stats.setText("waiting...")
+            worker = StreamWorker(client, self.session_id, messages, parent=self)
+            worker.chunk.connect(pane.renderer.feed)
+            worker.done.connect(lambda full, w=worker, p=pane: self._on_done(w, p, full, False))
+            worker.cancelled.connect(lambda full, w=worker, p=pane: self._on_done(w, p, full, True))
+            worker.error.connect(lambda err, p=pane: self._on_error(p, err))
+            worker.finished.connect(lambda w=worker, p=pane: self._on_finished(w, p))
+            pane.renderer.metrics = worker.metrics
+            self.workers.append(worker)
+        self.send_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+        self.status.setText(f"Asking {len(self.workers)} models...")
+        self.started = time.perf_counter()
+        for worker in self.workers:
+            worker.start()
+
+    def on_stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def _on_done(self, worker, pane, full: str, truncated: bool):
+        pane.renderer.finish(TRUNCATED_MARKER if truncated and full else "")
+        if full:
+            self.db.add_message(self.session_id, "assistant", full, truncated=truncated, model=worker.metrics.model)
+
+    def _on_error(self, pane, err: str):
+        pane.renderer.finish()
+        pane.view.append(f"<p><i>{html.escape(err)}</i></p>")
+
+    def _on_finished(self, worker, pane):
+        pane.renderer.metrics = None
+        row = worker.metrics.to_row()
+        self.db.add_metrics(row)
+        worker.metrics.log()
+        parts = [row["status"]]
+        if row["ttft_ms"] is not None:
+            parts.append(f"TTFT {row['ttft_ms']:.0f} ms")
+        if row["tokens_per_sec"] is not None:
+            parts.append(f"{row['tokens_per_sec']:.1f} tok/s")
+        if row["total_ms"] is not None:
+            parts.append(f"{row['total_ms'] / 1000:.1f} s")
+        pane.stats.setText(" | ".join(parts))
+        if not self.is_running():
+            wall = time.perf_counter() - self.started
+            slowest = max((w.metrics.to_row()["total_ms"] or 0) for w in self.workers) / 1000
+            self.status.setText(f"{len(self.workers)} answers in {wall:.1f} s (slowest model {slowest:.1f} s)")
+            self.send_btn.setEnabled(True)
+            self.stop_btn.setEnabled(False)
+
+    def done(self, result: int):
+        # Closing the dialog stops any answers still streaming. A worker may
+        # still be saving its partial answer, so instead of waiting for it
+        # here the main window owns it until it finishes.
+        self.on_stop()
+        owner = self.parent()
+        for worker in self.workers:
+            if not worker.isRunning():
+                continue
+            if owner is None:
+                worker.wait()
+                continue
+            worker.setParent(owner)
+            worker.finished.connect(worker.deleteLater)
+        super().done(result)
+
 class SettingsDialog(QDialog):
     def __init__(self, settings_path: str, parent=None):
         super().__init__(parent)
@@ -101,11 +480,107 @@ class SettingsDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
+class SearchDialog(QDialog):
+    session_selected = pyqtSignal(str)
+
+    PAGE_SIZE = 50
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Search History")
+        self.resize(700, 500)
+        self.db = db
+        self.offset = 0
+
+        lay = QVBoxLayout(self)
+        self.query = QLineEdit()
+        self.query.setPlaceholderText("Search all sessions...")
+        self.results = QListWidget()
+        self.results.setWordWrap(True)
+        self.more_btn = QPushButton("Load more")
+        self.more_btn.setEnabled(False)
+        lay.addWidget(self.query)
+        lay.addWidget(self.results)
+        lay.addWidget(self.more_btn)
+
+        # Debounce typing so each keystroke does not issue a query.
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(200)
+        self.timer.timeout.connect(self.run_search)
+        self.query.textChanged.connect(self.timer.start)
+        self.more_btn.clicked.connect(self.load_more)
+        self.results.itemActivated.connect(self._on_activated)
+
+    def run_search(self):
+        self.results.clear()
+        self.offset = 0
+        self.load_more()
+
+    def load_more(self):
+        rows = self.db.search(self.query.text(), self.PAGE_SIZE, self.offset)
+        self.offset += len(rows)
+        for r in rows:
+            item = QListWidgetItem()
+            label = QLabel(f"<small>[{r['created_at']}] {r['role']}</small><br>{r['snippet']}")
+            label.setWordWrap(True)
+            item.setData(Qt.ItemDataRole.UserRole, r["session_id"])
+            item.setSizeHint(label.sizeHint())
+            self.results.addItem(item)
+            self.results.setItemWidget(item, label)
+        self.more_btn.setEnabled(len(rows) == self.PAGE_SIZE)
+
+    def _on_activated(self, item):
+        self.session_selected.emit(item.data(Qt.ItemDataRole.UserRole))
+        self.accept()
+
+class StatsDialog(QDialog):
+    COLUMNS = [
+        ("Provider", "provider", "{}"),
+        ("Model", "model", "{}"),
+        ("Runs", "count", "{}"),
+        ("Connect p50", "connect_ms_p50", "{:.0f} ms"),
+        ("TTFT p50", "ttft_ms_p50", "{:.0f} ms"),
+        ("TTFT p95", "ttft_ms_p95", "{:.0f} ms"),
+        ("TTFT p99", "ttft_ms_p99", "{:.0f} ms"),
+        ("Tok/s p50", "tokens_per_sec_p50", "{:.1f}"),
+        ("Tok/s p95", "tokens_per_sec_p95", "{:.1f}"),
+        ("Tok/s p99", "tokens_per_sec_p99", "{:.1f}"),
+        ("UI flush p50", "ui_flush_p50_ms_p50", "{:.1f} ms"),
+        ("UI flush p95", "ui_flush_p50_ms_p95", "{:.1f} ms"),
+        ("UI flush p99", "ui_flush_p50_ms_p99", "{:.1f} ms"),
+        ("Load p50", "load_ms_p50", "{:.0f} ms"),
+        ("Prompt eval p50", "prompt_eval_ms_p50", "{:.0f} ms"),
+        ("Eval p50", "eval_ms_p50", "{:.0f} ms"),
+    ]
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Streaming Statistics")
+        self.resize(1000, 300)
+        summary = summarize_rows(db.recent_metrics())
+        table = QTableWidget(len(summary), len(self.COLUMNS))
+        table.setHorizontalHeaderLabels([c[0] for c in self.COLUMNS])
+        for row, entry in enumerate(summary):
+            for col, (_, key, fmt) in enumerate(self.COLUMNS):
+                value = entry.get(key)
+                table.setItem(row, col, QTableWidgetItem("-" if value is None else fmt.format(value)))
+        table.resizeColumnsToContents()
+        lay = QVBoxLayout(self)
+        lay.addWidget(table)
+        close = QPushButton("Close")
+        close.clicked.connect(self.accept)
+        lay.addWidget(close)
+
 class MainWindow(QMainWindow):
-    def __init__(self, db, settings_path: str):
+    # Startup paints first and does the slow parts later: the database is
+    # migrated on a DatabaseLoader thread and opened when it reports back,
+    # and the provider client (requests, aiohttp, ...) is built on first use.
+    def __init__(self, settings_path: str, db_path: str = "chat_history.db"):
         super().__init__()
-        self.db = db
-        ensure_schema(self.db.conn)
+        self.db = None
+        self.db_path = db_path
+        self.session_id = None
         self.settings_path = Path(settings_path)
         with open(self.settings_path) as f:
             self.settings = json.load(f)
@@ -115,21 +590,25 @@ class MainWindow(QMainWindow):
         if icon_path.exists():
             self.setWindowIcon(QIcon(str(icon_path)))
 
-        self.session_id = self.db.start_new_session()
-
         central = QWidget()
         self.setCentralWidget(central)
         v = QVBoxLayout(central)
 
-        self.chat_view = QTextEdit()
-        self.chat_view.setReadOnly(True)
+        self.chat_view = PagedTextView(
+            None, lambda m: chat_message_html(m["role"], m["content"], m["truncated"])
+        )
+        self.renderer = StreamRenderer(self.chat_view, self.settings.get("render_interval_ms", 16), self)
         self.input = QLineEdit()
         self.input.setPlaceholderText("Type your message...")
         self.send_btn = QPushButton("Send")
+        self.stop_btn = QPushButton("Stop")
+        self.stop_btn.setShortcut("Esc")
+        self.stop_btn.setEnabled(False)
 
         row = QHBoxLayout()
         row.addWidget(self.input)
         row.addWidget(self.send_btn)
+        row.addWidget(self.stop_btn)
 
         v.addWidget(self.chat_view)
         v.addLayout(row)
@@ -139,6 +618,7 @@ class MainWindow(QMainWindow):
 
         self.send_btn.clicked.connect(self.on_send)
         self.input.returnPressed.connect(self.on_send)
+        self.stop_btn.clicked.connect(self.on_stop)
 
         menubar = self.menuBar()
         m_app = menubar.addMenu("App")
@@ -147,6 +627,9 @@ class MainWindow(QMainWindow):
         m_export = menubar.addMenu("Export")
         m_settings = menubar.addMenu("Settings")
 
+        stats_act = QAction("Streaming Statistics", self)
+        stats_act.triggered.connect(lambda: StatsDialog(self.db, self).exec())
+        m_app.addAction(stats_act)
         quit_act = QAction("Quit", self)
         quit_act.triggered.connect(self.close)
         m_app.addAction(quit_act)
@@ -160,81 +643,238 @@ class MainWindow(QMainWindow):
         m_mode.addAction(offline_act)
         m_mode.addAction(openai_act)
         m_mode.addAction(anthropic_act)
+        m_mode.addSeparator()
+        compare_act = QAction("Compare Models...", self)
+        compare_act.setShortcut("Ctrl+M")
+        compare_act.triggered.connect(self.open_compare)
+        m_mode.addAction(compare_act)
 
         view_hist = QAction("View Session History", self)
         view_hist.triggered.connect(self.view_history)
         m_history.addAction(view_hist)
-
-        export_json = QAction("Export Session as JSON", self)
-        export_txt = QAction("Export Session as TXT", self)
-        export_json.triggered.connect(lambda: self.export_session("json"))
-        export_txt.triggered.connect(lambda: self.export_session("txt"))
-        m_export.addAction(export_json)
-        m_export.addAction(export_txt)
+        search_act = QAction("Search All History...", self)
+        search_act.setShortcut("Ctrl+F")
+        search_act.triggered.connect(self.open_search)
+        m_history.addAction(search_act)
+
+        export_session = QAction("Export Session...", self)
+        export_all = QAction("Export All Sessions...", self)
+        import_act = QAction("Import...", self)
+        export_session.triggered.connect(lambda: self.export_history(self.session_id))
+        export_all.triggered.connect(lambda: self.export_history(None))
+        import_act.triggered.connect(self.import_history)
+        m_export.addAction(export_session)
+        m_export.addAction(export_all)
+        m_export.addSeparator()
+        m_export.addAction(import_act)
 
         settings_act = QAction("Models and API Keys", self)
         settings_act.triggered.connect(self.open_settings)
         m_settings.addAction(settings_act)
-
-        self.client = LLMClient(self.settings, self.db)
+        cache_act = QAction("Response Cache Statistics", self)
+        cache_act.triggered.connect(self.show_cache_stats)
+        m_settings.addAction(cache_act)
+
+        self._client = None
+        self.stream_thread = None
+        self.summary_thread = None
+        self.warmup = None
+        self.archive_thread = None
+
+        # Disabled until the database is open.
+        self.needs_db = [self.input, self.send_btn, stats_act, cache_act, compare_act, m_history.menuAction(), m_export.menuAction()]
+        for w in self.needs_db:
+            w.setEnabled(False)
+        self.statusBar().showMessage("Opening chat history...")
+        self.db_loader = DatabaseLoader(self.db_path, self)
+        self.db_loader.ready.connect(self._on_db_ready)
+        self.db_loader.error.connect(self._on_db_error)
+        self.db_loader.start()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from llm_client import LLMClient
+            self._client = LLMClient(self.settings, self.db)
+        return self._client
+
+    def _on_db_ready(self):
+        # Migrations are done, so opening the connection here is quick.
+        self.db = Database(self.db_path)
+        self.write_errors = WriteErrors(self)
+        self.write_errors.failed.connect(self._on_write_error)
+        self.db.add_error_handler(self.write_errors)
+        self.chat_view.db = self.db
+        self.session_id = self.db.start_new_session()
         self.load_session_into_view()
+        for w in self.needs_db:
+            w.setEnabled(True)
+        self.statusBar().clearMessage()
+        self.input.setFocus()
+        self.warm_up()
+
+    def _on_write_error(self, err: str):
+        self.statusBar().showMessage("Could not save to chat history: " + err, 8000)
+
+    def _on_db_error(self, err: str):
+        self.statusBar().showMessage("Could not open chat history")
+        QMessageBox.critical(self, "Error", f"Could not open {self.db_path}: {err}")
+
+    def warm_up(self):
+        # Preload the local model in the background so the first message
+        # does not wait for Ollama to load it.
+        if self.settings.get("mode", "offline") != "offline" or not self.settings.get("ollama_preload", True):
+            return
+        if self.warmup is not None and self.warmup.is_alive():
+            return
+        self.warmup = WarmUpWorker(self.settings, self)
+        self.warmup.done.connect(self._on_warmup_done)
+        self.warmup.error.connect(self._on_warmup_error)
+        self.warmup.start()
+
+    def _on_warmup_done(self, model: str, load_ms: float):
+        self.statusBar().showMessage(f"{model} loaded ({load_ms / 1000:.1f} s)", 5000)
+
+    def _on_warmup_error(self, err: str):
+        self.statusBar().showMessage("Could not preload the offline model: " + err, 8000)
 
     def load_session_into_view(self):
-        messages = self.db.get_messages(self.session_id)
-        self.chat_view.clear()
-        for m in messages:
-            self.append_message(m["role"], m["content"])
+        self.chat_view.load(self.session_id)
 
     def append_message(self, role: str, content: str):
-        if role == "user":
-            self.chat_view.append(f"<p><b>You:</b> {content}</p>")
-        else:
-            self.chat_view.append(f"<p><b>Assistant:</b> {content}</p>")
+        self.chat_view.append(chat_message_html(role, content))
+
+    def is_streaming(self) -> bool:
+        return self.stream_thread is not None and self.stream_thread.isRunning()
 
     def on_send(self):
         text = self.input.text().strip()
         if not text:
             return
+        if self.is_streaming():
+            # One generation at a time: the draft stays in the input box until
+            # the current answer finishes or is stopped.
+            self.statusBar().showMessage("Still answering. Press Stop (Esc) to interrupt.", 3000)
+            return
         self.input.clear()
         self.db.add_message(self.session_id, "user", text)
         self.append_message("user", text)
 
-        messages = self.db.get_messages(self.session_id, as_openai_format=True)
-        self.stream_thread = StreamWorker(self.client, self.session_id, messages)
+        summary = self.db.get_summary(self.session_id)
+        budget = self.client.prompt_budget()
+        after_id = 0
+        summary_text = None
+        if summary:
+            summary_text = summary["content"]
+            after_id = summary["upto_id"]
+            budget -= estimate_tokens(summary_text)
+        recall = self.client.memory is not None
+        if recall:
+            # Room for the excerpts the worker retrieves from other sessions.
+            budget -= self.settings.get("memory_max_tokens", 512)
+        messages = build_context(self.db, self.session_id, budget, after_id=after_id)
+        self.stream_thread = StreamWorker(self.client, self.session_id, messages, summary_text, recall)
         self.stream_thread.chunk.connect(self._on_stream_chunk)
         self.stream_thread.done.connect(self._on_stream_done)
+        self.stream_thread.cancelled.connect(self._on_stream_cancelled)
         self.stream_thread.error.connect(self._on_stream_error)
+        self.stream_thread.finished.connect(self._on_stream_finished)
+        self.renderer.metrics = self.stream_thread.metrics
+        self.send_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
         self.stream_thread.start()
 
-    def _on_stream_chunk(self, chunk: str):
-        self._ensure_last_assistant_paragraph()
-        self._append_to_last_assistant(chunk)
+    def on_stop(self):
+        if self.is_streaming():
+            self.stream_thread.stop()
+
+    def _on_stream_finished(self):
+        self.send_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+        # Every outcome signal has been delivered and rendered by now.
+        metrics = self.stream_thread.metrics
+        self.renderer.metrics = None
+        self.db.add_metrics(metrics.to_row())
+        metrics.log()
+        if metrics.status == "ok" and metrics.provider != self.client.mode:
+            self.statusBar().showMessage(f"{self.client.mode} unavailable; answered by {metrics.provider}", 5000)
+
+    def _on_stream_chunk(self, chunk: str, emitted_at: float):
+        self.renderer.feed(chunk, emitted_at)
 
     def _on_stream_done(self, full: str):
-        self.db.add_message(self.session_id, "assistant", full)
+        self.renderer.finish()
+        self.db.add_message(self.session_id, "assistant", full, model=self.stream_thread.metrics.model)
+        self.maybe_summarize()
+
+    def maybe_summarize(self):
+        if not self.settings.get("summarize", False):
+            return
+        if self.summary_thread is not None and self.summary_thread.isRunning():
+            return
+        batch = self.settings.get("summary_batch", 40)
+        turns = self.db.unsummarized_messages(
+            self.session_id, self.settings.get("summary_keep_recent", 20), batch
+        )
+        if len(turns) < min(batch, self.settings.get("summary_min_turns", 10)):
+            return
+        previous = self.db.get_summary(self.session_id)
+        self.summary_thread = SummarizeWorker(
+            self.client, self.session_id, previous["content"] if previous else None, turns
+        )
+        self.summary_thread.done.connect(self._on_summary_done)
+        self.summary_thread.error.connect(self._on_summary_error)
+        self.summary_thread.start()
+
+    def _on_summary_done(self, session_id: str, text: str, upto_id: int):
+        self.db.save_summary(session_id, text, upto_id)
+        if session_id == self.session_id:
+            # Catch up one batch at a time until only recent turns remain.
+            self.maybe_summarize()
+
+    def _on_summary_error(self, err: str):
+        # The next reply tries again; until then the context keeps the
+        # older turns unsummarized.
+        log.warning("summarizing session %s failed: %s", self.summary_thread.session_id, err)
+        self.statusBar().showMessage("Could not summarize older messages: " + err, 8000)
+
+    def _on_stream_cancelled(self, partial: str):
+        if partial:
+            self.renderer.finish(TRUNCATED_MARKER)
+            self.db.add_message(self.session_id, "assistant", partial, truncated=True,
+                                model=self.stream_thread.metrics.model)
+        else:
+            self.renderer.finish()
 
     def _on_stream_error(self, err: str):
+        self.renderer.finish()
         QMessageBox.critical(self, "Error", err)
 
-    def _ensure_last_assistant_paragraph(self):
-        cursor = self.chat_view.textCursor()
-        cursor.movePosition(cursor.MoveOperation.End)
-        html = self.chat_view.toHtml()
-        if "Assistant:" not in html[-300:]:
-            self.chat_view.append(f"<p><b>Assistant:</b> </p>")
-
-    def _append_to_last_assistant(self, text: str):
-        cursor = self.chat_view.textCursor()
-        cursor.movePosition(cursor.MoveOperation.End)
-        cursor.insertText(text)
-        self.chat_view.setTextCursor(cursor)
+    def closeEvent(self, event):
+        if self.is_streaming():
+            self.stream_thread.stop()
+            self.stream_thread.wait()
+        if self.archive_thread is not None and self.archive_thread.isRunning():
+            # A cancelled export removes its partial file; an import rolls back.
+            self.archive_thread.stop()
+            self.archive_thread.wait()
+        # A migration in progress is one transaction; let it finish.
+        self.db_loader.wait()
+        if self._client is not None and self._client.memory is not None:
+            import memory
+            memory.close_all()
+        if self.db is not None:
+            # Commits whatever is still queued for the writer.
+            self.db.close()
+        super().closeEvent(event)
 
     def switch_mode(self, mode: str):
         self.settings["mode"] = mode
         with open(self.settings_path, "w") as f:
             json.dump(self.settings, f, indent=2)
         self.status_lbl.setText("Mode: " + mode)
-        self.client = LLMClient(self.settings, self.db)
+        self._client = None
+        self.warm_up()
 
     def open_settings(self):
         dlg = SettingsDialog(str(self.settings_path), self)
@@ -242,40 +882,117 @@ class MainWindow(QMainWindow):
             with open(self.settings_path) as f:
                 self.settings = json.load(f)
             self.status_lbl.setText("Mode: " + self.settings.get("mode", "offline"))
-            self.client = LLMClient(self.settings, self.db)
+            self._client = None
+            self.warm_up()
+
+    def open_compare(self):
+        CompareDialog(self.settings, self.db, self).exec()
+
+    def open_search(self):
+        dlg = SearchDialog(self.db, self)
+        dlg.session_selected.connect(self.open_session)
+        dlg.exec()
+
+    def open_session(self, session_id: str):
+        if self.is_streaming():
+            self.statusBar().showMessage("Stop the current answer before opening another session.", 3000)
+            return
+        self.session_id = session_id
+        self.load_session_into_view()
+
+    def show_cache_stats(self):
+        if self.client.cache is None:
+            QMessageBox.information(self, "Response Cache", "The response cache is off. Set cache_enabled in settings.json.")
+            return
+        st = self.client.cache.stats()
+        text = (
+            f"Hit rate: {st['hit_rate']:.1%}\n"
+            f"Memory hits: {st['memory_hits']}\nDisk hits: {st['disk_hits']}\nMisses: {st['misses']}\n"
+            f"Stored: {st['stores']}\nEvicted: {st['evictions']}\n"
+            f"Entries: {st['memory_entries']} in memory, {st['disk_entries']} on disk ({st['disk_bytes'] / 1024:.1f} KiB)"
+        )
+        box = QMessageBox(self)
+        box.setWindowTitle("Response Cache")
+        box.setText(text)
+        clear = box.addButton("Clear Cache", QMessageBox.ButtonRole.DestructiveRole)
+        box.addButton(QMessageBox.StandardButton.Close)
+        box.exec()
+        if box.clickedButton() is clear:
+            self.client.cache.clear()
 
     def view_history(self):
-        msgs = self.db.get_messages(self.session_id)
-        lines = []
-        for m in msgs:
-            lines.append(f"[{m['created_at']}] {m['role']}: {m['content']}")
         dlg = QDialog(self)
         dlg.setWindowTitle("Session History")
         lay = QVBoxLayout(dlg)
-        box = QTextEdit()
-        box.setReadOnly(True)
-        box.setPlainText("\n\n".join(lines))
+        box = PagedTextView(self.db, history_line_html)
         lay.addWidget(box)
+        box.load(self.session_id)
         close = QPushButton("Close")
         close.clicked.connect(dlg.accept)
         lay.addWidget(close)
         dlg.exec()
 
-    def export_session(self, kind: str):
-        if kind == "json":
-            path, _ = QFileDialog.getSaveFileName(self, "Save JSON", "conversation.json", "JSON Files (*.json)")
-            if not path:
-                return
-            data = self.db.get_messages(self.session_id)
-            with open(path, "w") as f:
-                json.dump(data, f, indent=2)
-            QMessageBox.information(self, "Export", "Exported as JSON")
+    EXPORT_FILTERS = {
+        "Compressed archive (*.ndjson.gz)": "archive",
+        "NDJSON (*.ndjson)": "ndjson",
+        "JSON (*.json)": "json",
+        "Text (*.txt)": "txt",
+    }
+
+    def export_history(self, session_id):
+        # session_id None exports every session.
+        import archive
+        name = "conversation" if session_id else "chat_history"
+        path, chosen = QFileDialog.getSaveFileName(
+            self, "Export", name + archive.FORMATS["archive"], ";;".join(self.EXPORT_FILTERS)
+        )
+        if not path:
+            return
+        fmt = self.EXPORT_FILTERS.get(chosen, "archive")
+        if not path.endswith(archive.FORMATS[fmt]):
+            path += archive.FORMATS[fmt]
+
+        def job(progress, stop):
+            count = archive.export_messages(self.db_path, path, fmt, session_id, progress, stop)
+            return f"Exported {count:,} messages to {path}"
+
+        self.run_archive_job("Exporting...", job)
+
+    def import_history(self):
+        import archive
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Import", "", "Chat exports (*.ndjson.gz *.ndjson);;All Files (*)"
+        )
+        if not path:
+            return
+
+        def job(progress, stop):
+            sessions, messages = archive.import_messages(self.db, path, progress=progress, stop=stop)
+            return f"Imported {messages:,} messages in {sessions:,} sessions"
+
+        self.run_archive_job("Importing...", job)
+
+    def run_archive_job(self, label: str, job):
+        if self.archive_thread is not None and self.archive_thread.isRunning():
+            self.statusBar().showMessage("An export or import is already running.", 3000)
+            return
+        dlg = QProgressDialog(label, "Cancel", 0, 1000, self)
+        dlg.setWindowModality(Qt.WindowModality.WindowModal)
+        dlg.setMinimumDuration(300)
+        self.archive_thread = ArchiveWorker(job, self)
+        self.archive_thread.progress.connect(lambda done, total: dlg.setValue(int(1000 * done / max(total, 1))))
+        self.archive_thread.done.connect(lambda msg: self._on_archive_done(dlg, msg))
+        self.archive_thread.error.connect(lambda err: self._on_archive_error(dlg, err))
+        dlg.canceled.connect(self.archive_thread.stop)
+        self.archive_thread.start()
+
+    def _on_archive_done(self, dlg, message: str):
+        dlg.reset()
+        if message:
+            self.statusBar().showMessage(message, 8000)
         else:
-            path, _ = QFileDialog.getSaveFileName(self, "Save TXT", "conversation.txt", "Text Files (*.txt)")
-            if not path:
-                return
-            data = self.db.get_messages(self.session_id)
-            with open(path, "w") as f:
-                for m in data:
-                    f.write(f"[{m['created_at']}] {m['role'].upper()}: {m['content']}\n\n")
-            QMessageBox.information(self, "Export", "Exported as TXT")
+            self.statusBar().showMessage("Cancelled", 3000)
+
+    def _on_archive_error(self, dlg, err: str):
+        dlg.reset()
+        QMessageBox.critical(self, "Error", err)
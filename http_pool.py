@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# One long-lived requests.Session per provider origin, shared by every
+# LLMClient so that mode switches and settings saves keep warm connections.
+_lock = threading.Lock()
+_sessions = {}
+# aiohttp sessions are bound to the event loop that created them: origin ->
+# (session, config) per loop, forgotten along with the loop.
+_async_sessions = weakref.WeakKeyDictionary()
+_retired_async = weakref.WeakKeyDictionary()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _new_session(pool_size: int, keep_alive: bool) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive" if keep_alive else "close"
+    return session
+
+
+def get_session(base_url: str, pool_size: int = 4, keep_alive: bool = True) -> requests.Session:
+    key = _origin(base_url)
+    config = (pool_size, keep_alive)
+    with _lock:
+        entry = _sessions.get(key)
+        if entry is not None and entry[1] == config:
+            return entry[0]
+        # A replaced session is not closed here: streams still reading from
+        # it would break. Their responses keep it alive until they finish,
+        # and its connections close when it is garbage collected.
+        session = _new_session(pool_size, keep_alive)
+        _sessions[key] = (session, config)
+        return session
+
+
+def close_all():
+    with _lock:
+        for session, _ in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+async def get_async_session(base_url: str, pool_size: int = 4, keep_alive: bool = True):
+    import aiohttp
+
+    sessions = _async_sessions.setdefault(asyncio.get_running_loop(), {})
+    key = _origin(base_url)
+    config = (pool_size, keep_alive)
+    entry = sessions.get(key)
+    if entry is not None and entry[1] == config and not entry[0].closed:
+        return entry[0]
+    if entry is not None and not entry[0].closed:
+        # As above, but aiohttp wants its sessions closed explicitly, so
+        # replaced ones are closed by aclose_all.
+        _retired_async.setdefault(asyncio.get_running_loop(), []).append(entry[0])
+    connector = aiohttp.TCPConnector(limit_per_host=pool_size, force_close=not keep_alive)
+    session = aiohttp.ClientSession(connector=connector)
+    sessions[key] = (session, config)
+    return session
+
+
+async def aclose_all():
+    loop = asyncio.get_running_loop()
+    sessions = [session for session, _ in _async_sessions.pop(loop, {}).values()]
+    for session in sessions + _retired_async.pop(loop, []):
+        await session.close()
@@ -1,8 +1,140 @@
-
+import asyncio
+import logging
 import os
-import json
-import requests
-from typing import Generator, List, Dict
+import socket
+import threading
+import time
+from typing import AsyncGenerator, Callable, Generator, List, Dict, NamedTuple, Optional
+
+import cache
+import http_pool
+import router
+from metrics import StreamMetrics
+from context import context_limit, estimate_tokens
+from stream_decoder import DONE, NDJSONDecoder, SSEDecoder
+
+OPENAI_BASE = "https://api.openai.com"
+ANTHROPIC_BASE = "https://api.anthropic.com"
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+MEMORY_PREFIX = "Excerpts from earlier conversations that may be relevant:\n"
+
+FAILOVER_CHAIN = ["offline", "openai", "anthropic"]
+
+# Settings key holding the model name for each mode.
+MODEL_SETTINGS = {"offline": "offline_model", "openai": "online_model", "anthropic": "anthropic_model"}
+
+log = logging.getLogger("localai.router")
+
+
+def settings_with(settings: dict, mode: Optional[str] = None, model: Optional[str] = None, **overrides) -> dict:
+    # A copy of settings for one request: mode, the model for that mode and
+    # plain keys such as temperature or max_tokens.
+    settings = dict(settings)
+    if mode:
+        settings["mode"] = mode
+    if model:
+        settings[MODEL_SETTINGS.get(settings.get("mode", "offline"), "online_model")] = model
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    return settings
+
+
+class ProviderRequest(NamedTuple):
+    base: str
+    path: str
+    headers: Dict
+    payload: Dict
+    decoder: Callable[[], object]
+    extract: Callable[[object], Optional[str]]
+    # Called with the last event of each decoded batch; providers that report
+    # token counts or timings in their final message record them on metrics.
+    usage: Optional[Callable[[object, StreamMetrics], None]] = None
+
+
+class CancelToken:
+    # Shared between the UI and a streaming generation. cancel() may be called
+    # from any thread; it aborts the in-flight HTTP response immediately
+    # instead of waiting for the next chunk to arrive, and wakes anything
+    # registered with on_cancel().
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._response = None
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            response, self._response = self._response, None
+            callbacks, self._callbacks = self._callbacks, []
+        if response is not None:
+            _abort_response(response)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        # Calls callback() on the cancelling thread when cancel() is called,
+        # or right away if it already was. Returns a function that
+        # unregisters it.
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def attach(self, response):
+        with self._lock:
+            if not self._event.is_set():
+                self._response = response
+                return
+        _abort_response(response)
+
+    def detach(self):
+        with self._lock:
+            self._response = None
+
+    def wait(self, timeout: float) -> bool:
+        # Sleeps up to timeout seconds; returns early (True) if cancelled.
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout: float) -> bool:
+        # wait() for the event loop. cancel() usually comes from another
+        # thread, so it reaches the loop through call_soon_threadsafe.
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        unregister = self.on_cancel(lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            unregister()
+        return self.cancelled
+
+
+def _abort_response(response):
+    # Closing a socket does not wake a thread blocked in recv(); shutting it
+    # down does. Fall back to a plain close if the socket is not reachable.
+    fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+    sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
 
 class LLMClient:
     def __init__(self, settings: dict, db):
@@ -10,6 +142,8 @@ class LLMClient:
         self.db = db
         self.mode = settings.get("mode", "offline")
         self.ollama_base = settings.get("ollama_base_url", "http://localhost:11434")
+        self.openai_base = settings.get("openai_base_url", OPENAI_BASE)
+        self.anthropic_base = settings.get("anthropic_base_url", ANTHROPIC_BASE)
         self.offline_model = settings.get("offline_model", "llama3")
         self.online_model = settings.get("online_model", "gpt-4o-mini")
         self.anthropic_model = settings.get("anthropic_model", "claude-3-opus-20240229")
@@ -18,98 +152,528 @@ class LLMClient:
         self.system_prompt = settings.get("system_prompt", "You are a helpful assistant.")
         self.openai_key = os.getenv("OPENAI_API_KEY", settings.get("openai_api_key", ""))
         self.anthropic_key = os.getenv("ANTHROPIC_API_KEY", settings.get("anthropic_api_key", ""))
+        self.pool_size = settings.get("http_pool_size", 4)
+        self.keep_alive = settings.get("http_keep_alive", True)
+        self.timeout = (
+            settings.get("http_connect_timeout", 10),
+            settings.get("http_read_timeout", 600),
+        )
+        self.ollama_keep_alive = settings.get("ollama_keep_alive", "30m")
+        self.retry_attempts = settings.get("retry_attempts", 2)
+        self.retry_backoff_base = settings.get("retry_backoff_base", 0.5)
+        self.retry_backoff_max = settings.get("retry_backoff_max", 8.0)
+        self.memory = None
+        if settings.get("memory_enabled", False) and db is not None:
+            self.memory = self._open_memory(db)
+        self.cache = None
+        if settings.get("cache_enabled", False):
+            self.cache = cache.get_cache(
+                settings.get("cache_path", "response_cache.db"),
+                memory_entries=settings.get("cache_memory_entries", 256),
+                max_entries=settings.get("cache_max_entries", 10000),
+                max_bytes=settings.get("cache_max_bytes", 64 * 1024 * 1024),
+                ttl_seconds=settings.get("cache_ttl_seconds", 7 * 24 * 3600),
+            )
+
+    def _open_memory(self, db):
+        try:
+            import memory
+        except ImportError as e:
+            logging.getLogger("localai.memory").warning("semantic memory disabled: %s", e)
+            return None
+        s = self.settings
+        embedder = memory.OllamaEmbedder(
+            self.ollama_base, s.get("embedding_model", "nomic-embed-text"), self.ollama_keep_alive,
+            self.timeout, self.pool_size
+        )
+        return memory.get_memory(
+            db, embedder,
+            batch_size=s.get("memory_batch_size", 32),
+            min_chars=s.get("memory_min_chars", 20),
+            ann=s.get("memory_ann", "auto"),
+            ann_threshold=s.get("memory_ann_threshold", 100000),
+            ann_ef=s.get("memory_ann_ef", 128),
+        )
+
+    @property
+    def model(self) -> str:
+        return self._model_for(self.mode)
 
-    def stream_chat(self, messages: List[Dict], session_id: str) -> Generator[str, None, None]:
-        if self.mode == "offline":
-            yield from self._ollama_stream(messages)
-        elif self.mode == "anthropic":
-            yield from self._anthropic_stream(messages)
+    def _model_for(self, mode: str) -> str:
+        if mode == "offline":
+            return self.offline_model
+        if mode == "anthropic":
+            return self.anthropic_model
+        return self.online_model
+
+    def _base_for(self, mode: str) -> str:
+        if mode == "offline":
+            return self.ollama_base
+        if mode == "anthropic":
+            return self.anthropic_base
+        return self.openai_base
+
+    def prompt_budget(self) -> int:
+        limit = context_limit(self.settings, self.model)
+        return limit - self.max_tokens - estimate_tokens(self.system_prompt)
+
+    def stream_chat(self, messages: List[Dict], session_id: str, summary: Optional[str] = None,
+                    cancel: Optional[CancelToken] = None, metrics: Optional[StreamMetrics] = None,
+                    recall: bool = False) -> Generator[str, None, None]:
+        # When cancel fires the generator stops early without raising; callers
+        # check cancel.cancelled to tell a stopped answer from a finished one.
+        # recall=True adds relevant excerpts from other sessions (semantic
+        # memory) to the prompt.
+        if recall:
+            messages = self._with_memory(messages, session_id)
+        try:
+            for piece in self._stream_chat(messages, summary, cancel, metrics):
+                if metrics is not None:
+                    metrics.mark_chunk(piece)
+                yield piece
+        except GeneratorExit:
+            _finish(metrics, "cancelled")
+            raise
+        except Exception:
+            _finish(metrics, "error")
+            raise
+        _finish(metrics, "cancelled" if cancel is not None and cancel.cancelled else "ok")
+
+    def _stream_chat(self, messages: List[Dict], summary: Optional[str], cancel: Optional[CancelToken],
+                     metrics: Optional[StreamMetrics]) -> Generator[str, None, None]:
+        key = self._cache_key(messages, summary)
+        if key is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                if metrics is not None:
+                    metrics.cache_hit = True
+                    metrics.mark_connected()
+                yield from _replay(hit, cancel)
+                return
+        parts = []
+        served = []
+        for piece in self._routed_stream(messages, summary, cancel, metrics, served):
+            parts.append(piece)
+            yield piece
+        # An answer from a fallback provider is not cached under the key of
+        # the selected one.
+        if key is not None and parts and served == [self.mode] and not (cancel is not None and cancel.cancelled):
+            self.cache.put(key, "".join(parts))
+
+    def _provider_chain(self) -> List[str]:
+        # The selected mode always goes first; with failover enabled the rest
+        # of failover_chain follows in order.
+        chain = [self.mode]
+        if self.settings.get("failover_enabled", False):
+            for mode in self.settings.get("failover_chain", FAILOVER_CHAIN):
+                if mode in FAILOVER_CHAIN and mode not in chain:
+                    chain.append(mode)
+        return chain
+
+    def _breaker(self, mode: str) -> router.CircuitBreaker:
+        return router.get_breaker(
+            mode, self._base_for(mode),
+            failure_threshold=self.settings.get("breaker_failure_threshold", 3),
+            reset_seconds=self.settings.get("breaker_reset_seconds", 30.0),
+        )
+
+    def _probe(self, mode: str) -> bool:
+        base = self._base_for(mode)
+        headers = {}
+        if mode == "openai":
+            headers = {"Authorization": f"Bearer {self.openai_key}"}
+        elif mode == "anthropic":
+            headers = {"x-api-key": self.anthropic_key, "anthropic-version": "2023-06-01"}
+        session = http_pool.get_session(base, self.pool_size, self.keep_alive)
+        timeout = self.settings.get("health_probe_timeout", 2.0)
+        with session.get(base + router.HEALTH_PATHS[mode], headers=headers, timeout=timeout) as r:
+            ok = r.ok
+        log.info("health probe %s %s", mode, "ok" if ok else f"failed ({r.status_code})")
+        return ok
+
+    def _record_error(self, breaker: router.CircuitBreaker, error: Exception):
+        if router.is_transient(error):
+            breaker.record_failure()
         else:
-            yield from self._openai_stream(messages)
+            # Reachable but refusing this request (bad key, bad model): not a
+            # health problem, but a half-open trial slot must be handed back.
+            breaker.release()
 
-    def _with_system(self, messages: List[Dict]) -> List[Dict]:
-        has_system = any(m.get("role") == "system" for m in messages)
-        if has_system:
+    def _retry_delay(self, breaker: router.CircuitBreaker, error: Exception, attempt: int) -> Optional[float]:
+        # Seconds to wait before retrying the same provider, or None to move
+        # on to the next one in the chain.
+        if not router.is_transient(error) or attempt >= self.retry_attempts or breaker.state == router.OPEN:
+            return None
+        delay = router.retry_after(error)
+        if delay is None:
+            delay = router.backoff_delay(attempt, self.retry_backoff_base, self.retry_backoff_max)
+        return min(delay, self.retry_backoff_max)
+
+    def _routed_stream(self, messages: List[Dict], summary: Optional[str], cancel: Optional[CancelToken],
+                       metrics: Optional[StreamMetrics], served: List[str]) -> Generator[str, None, None]:
+        # Walks the provider chain, retrying transient failures with jittered
+        # backoff. Retries and failover only happen before the first piece is
+        # yielded: once text has reached the caller a failure is raised, since
+        # a fresh generation would repeat (or contradict) what was shown.
+        errors = {}
+        for mode in self._provider_chain():
+            try:
+                req = self._request_for(mode, messages, summary)
+            except ValueError as e:
+                errors[mode] = e
+                continue
+            breaker = self._breaker(mode)
+            if not breaker.allow(lambda: self._probe(mode)):
+                errors[mode] = RuntimeError(f"{mode} is unavailable (circuit open)")
+                continue
+            if metrics is not None:
+                metrics.provider, metrics.model = mode, self._model_for(mode)
+            attempt = 0
+            while True:
+                if cancel is not None and cancel.cancelled:
+                    breaker.release()
+                    return
+                started = False
+                try:
+                    for piece in self._stream(req, cancel, metrics):
+                        started = True
+                        yield piece
+                except Exception as e:
+                    if started:
+                        self._record_error(breaker, e)
+                        raise
+                    delay = self._on_failure(mode, breaker, e, attempt, errors)
+                    if delay is None:
+                        break
+                    if cancel is not None and cancel.wait(delay):
+                        breaker.release()
+                        return
+                    if cancel is None:
+                        time.sleep(delay)
+                    attempt += 1
+                    continue
+                if cancel is not None and cancel.cancelled:
+                    breaker.release()
+                else:
+                    breaker.record_success()
+                served.append(mode)
+                return
+        _raise_errors(errors)
+
+    async def astream_chat(self, messages: List[Dict], session_id: str, summary: Optional[str] = None,
+                           cancel: Optional[CancelToken] = None,
+                           metrics: Optional[StreamMetrics] = None) -> AsyncGenerator[str, None]:
+        # metrics, if given, learns which provider and model answered (it may
+        # be a fallback) and whether the cache did; callers time the chunks.
+        key = self._cache_key(messages, summary)
+        if key is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                if metrics is not None:
+                    metrics.cache_hit = True
+                for piece in _replay(hit, cancel):
+                    yield piece
+                return
+        parts = []
+        served = []
+        async for piece in self._arouted_stream(messages, summary, cancel, metrics, served):
+            parts.append(piece)
+            yield piece
+        if key is not None and parts and served == [self.mode] and not (cancel is not None and cancel.cancelled):
+            self.cache.put(key, "".join(parts))
+
+    async def _arouted_stream(self, messages: List[Dict], summary: Optional[str], cancel: Optional[CancelToken],
+                              metrics: Optional[StreamMetrics], served: List[str]) -> AsyncGenerator[str, None]:
+        # Async counterpart of _routed_stream. A sync generator cannot be
+        # driven from the event loop without blocking it, so the loop is
+        # written twice; the decisions it makes live in shared helpers
+        # (_provider_chain, _breaker, _on_failure) and any change to one copy
+        # belongs in the other. Only the I/O differs: the blocking health
+        # probe runs in a worker thread so it does not stall the loop.
+        errors = {}
+        for mode in self._provider_chain():
+            try:
+                req = self._request_for(mode, messages, summary)
+            except ValueError as e:
+                errors[mode] = e
+                continue
+            breaker = self._breaker(mode)
+            if breaker.state != router.CLOSED and not await asyncio.to_thread(breaker.allow, lambda: self._probe(mode)):
+                errors[mode] = RuntimeError(f"{mode} is unavailable (circuit open)")
+                continue
+            if metrics is not None:
+                metrics.provider, metrics.model = mode, self._model_for(mode)
+            attempt = 0
+            while True:
+                if cancel is not None and cancel.cancelled:
+                    breaker.release()
+                    return
+                started = False
+                try:
+                    async for piece in self._astream(req, cancel):
+                        started = True
+                        yield piece
+                except Exception as e:
+                    if started:
+                        self._record_error(breaker, e)
+                        raise
+                    delay = self._on_failure(mode, breaker, e, attempt, errors)
+                    if delay is None:
+                        break
+                    if cancel is not None and await cancel.wait_async(delay):
+                        breaker.release()
+                        return
+                    if cancel is None:
+                        await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                if cancel is not None and cancel.cancelled:
+                    breaker.release()
+                else:
+                    breaker.record_success()
+                served.append(mode)
+                return
+        _raise_errors(errors)
+
+    def _on_failure(self, mode: str, breaker, e: Exception, attempt: int, errors: dict) -> Optional[float]:
+        # A provider failed before anything was yielded. Returns the backoff
+        # before retrying it, or None to fail over to the next provider.
+        self._record_error(breaker, e)
+        errors[mode] = e
+        delay = self._retry_delay(breaker, e, attempt)
+        if delay is None:
+            log.warning("%s failed: %s", mode, e)
+        else:
+            log.warning("%s attempt %d failed: %s; retrying in %.2fs", mode, attempt + 1, e, delay)
+        return delay
+
+    def _cache_key(self, messages: List[Dict], summary: Optional[str]) -> Optional[str]:
+        # Only near-deterministic requests are worth replaying.
+        if self.cache is None or self.temperature > self.settings.get("cache_max_temperature", 0.0):
+            return None
+        return cache.make_key(
+            self.mode, self.model, self.temperature, self.max_tokens, self._with_system(messages, summary)
+        )
+
+    def _request_for(self, mode: str, messages: List[Dict], summary: Optional[str] = None) -> ProviderRequest:
+        if mode == "offline":
+            return self._ollama_request(messages, summary)
+        if mode == "anthropic":
+            return self._anthropic_request(messages, summary)
+        return self._openai_request(messages, summary)
+
+    def _post(self, base: str, path: str, **kwargs):
+        session = http_pool.get_session(base, self.pool_size, self.keep_alive)
+        return session.post(base + path, stream=True, timeout=self.timeout, **kwargs)
+
+    def _post_cancellable(self, req: ProviderRequest, cancel: CancelToken):
+        # requests cannot interrupt connecting or waiting for headers, and
+        # Ollama sends no headers until the model is loaded and the prompt
+        # evaluated, which can take minutes. So the POST runs on a helper
+        # thread and Stop returns at once; a response that arrives after
+        # that is closed by attach(). Returns None if cancelled first.
+        box = {}
+        ready = threading.Event()
+
+        def post():
+            try:
+                response = self._post(req.base, req.path, headers=req.headers, json=req.payload)
+            except BaseException as e:
+                box["error"] = e
+            else:
+                box["response"] = response
+                cancel.attach(response)
+            ready.set()
+
+        unregister = cancel.on_cancel(ready.set)
+        threading.Thread(target=post, name="llm-post", daemon=True).start()
+        ready.wait()
+        unregister()
+        if cancel.cancelled:
+            return None
+        if "error" in box:
+            raise box["error"]
+        return box["response"]
+
+    def _stream(self, req: ProviderRequest, cancel: Optional[CancelToken] = None,
+                metrics: Optional[StreamMetrics] = None) -> Generator[str, None, None]:
+        if cancel is None:
+            r = self._post(req.base, req.path, headers=req.headers, json=req.payload)
+        else:
+            r = self._post_cancellable(req, cancel)
+            if r is None:
+                return
+        with r:
+            if metrics is not None:
+                metrics.mark_connected()
+            try:
+                r.raise_for_status()
+                decoder = req.decoder()
+                usage = req.usage if metrics is not None else None
+                for data in _iter_bytes(r):
+                    events = decoder.feed(data)
+                    pieces, done = _texts(req, events)
+                    yield from pieces
+                    if usage is not None and events:
+                        usage(events[-1], metrics)
+                    if done:
+                        break
+                else:
+                    events = decoder.close()
+                    yield from _texts(req, events)[0]
+                    if usage is not None and events:
+                        usage(events[-1], metrics)
+            except Exception:
+                if cancel is not None and cancel.cancelled:
+                    return
+                raise
+            finally:
+                if cancel is not None:
+                    cancel.detach()
+
+    async def _astream(self, req: ProviderRequest, cancel: Optional[CancelToken] = None) -> AsyncGenerator[str, None]:
+        import aiohttp
+
+        session = await http_pool.get_async_session(req.base, self.pool_size, self.keep_alive)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        async with session.post(req.base + req.path, headers=req.headers, json=req.payload, timeout=timeout) as r:
+            r.raise_for_status()
+            decoder = req.decoder()
+            done = False
+            async for data in r.content.iter_any():
+                if cancel is not None and cancel.cancelled:
+                    return
+                pieces, done = _texts(req, decoder.feed(data))
+                for piece in pieces:
+                    yield piece
+                if done:
+                    break
+            if not done:
+                for piece in _texts(req, decoder.close())[0]:
+                    yield piece
+
+    def _with_memory(self, messages: List[Dict], session_id: str) -> List[Dict]:
+        if self.memory is None:
             return messages
-        return [{"role": "system", "content": self.system_prompt}] + messages
+        query = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        try:
+            hits = self.memory.search(
+                query, self.settings.get("memory_top_k", 4), exclude_session=session_id,
+                min_score=self.settings.get("memory_min_score", 0.5)
+            )
+        except Exception as e:
+            # Retrieval is best effort; the answer goes ahead without it.
+            logging.getLogger("localai.memory").warning("retrieval failed: %s", e)
+            return messages
+        budget = self.settings.get("memory_max_tokens", 512) - estimate_tokens(MEMORY_PREFIX)
+        max_chars = self.settings.get("memory_snippet_chars", 400)
+        lines = []
+        for hit in hits:
+            text = hit["content"]
+            if len(text) > max_chars:
+                text = text[:max_chars].rstrip() + "…"
+            line = f"- {hit['role']} ({hit['created_at'][:10]}): {text}"
+            budget -= estimate_tokens(line)
+            if budget < 0:
+                break
+            lines.append(line)
+        if not lines:
+            return messages
+        messages = self._with_system(messages)
+        n = 0
+        while n < len(messages) and messages[n].get("role") == "system":
+            n += 1
+        note = {"role": "system", "content": MEMORY_PREFIX + "\n".join(lines)}
+        return messages[:n] + [note] + messages[n:]
+
+    def _with_system(self, messages: List[Dict], summary: Optional[str] = None) -> List[Dict]:
+        has_system = any(m.get("role") == "system" for m in messages)
+        if not has_system:
+            messages = [{"role": "system", "content": self.system_prompt}] + messages
+        if summary:
+            # The rolling summary follows the system prompt and stands in for
+            # the turns that are no longer sent verbatim.
+            n = 0
+            while n < len(messages) and messages[n].get("role") == "system":
+                n += 1
+            note = {"role": "system", "content": SUMMARY_PREFIX + summary}
+            messages = messages[:n] + [note] + messages[n:]
+        return messages
 
-    def _ollama_stream(self, messages: List[Dict]) -> Generator[str, None, None]:
-        url = f"{self.ollama_base}/api/chat"
+    def _ollama_options(self) -> Dict:
+        # Ollama reloads the model whenever num_ctx (or the thread/GPU
+        # options) differ from the loaded instance, so every request and the
+        # warm-up send the same pinned set. num_ctx follows the context limit
+        # the prompt budget is computed from; Ollama's own default is smaller
+        # and would silently cut off the start of a full prompt.
+        options = {"num_ctx": context_limit(self.settings, self.offline_model)}
+        options.update(self.settings.get("ollama_options", {}))
+        options["temperature"] = self.temperature
+        return options
+
+    def warm_up(self) -> Optional[float]:
+        # Loads offline_model so the first message does not pay for it.
+        # Returns the load time Ollama reports, in ms.
         payload = {
             "model": self.offline_model,
-            "messages": self._with_system(messages),
-            "stream": True,
-            "options": {"temperature": self.temperature}
+            "messages": [],
+            "stream": False,
+            "keep_alive": self.ollama_keep_alive,
+            "options": self._ollama_options(),
         }
-        with requests.post(url, json=payload, stream=True, timeout=600) as r:
+        session = http_pool.get_session(self.ollama_base, self.pool_size, self.keep_alive)
+        timeout = (self.timeout[0], self.settings.get("ollama_warmup_timeout", 300))
+        with session.post(self.ollama_base + "/api/chat", json=payload, timeout=timeout) as r:
             r.raise_for_status()
-            for line in r.iter_lines(decode_unicode=True):
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-                msg = data.get("message", {})
-                chunk = msg.get("content", "")
-                if chunk:
-                    yield chunk
+            data = r.json()
+        return _ns_to_ms(data.get("load_duration"))
+
+    def _ollama_request(self, messages: List[Dict], summary: Optional[str] = None) -> ProviderRequest:
+        payload = {
+            "model": self.offline_model,
+            "messages": self._with_system(messages, summary),
+            "stream": True,
+            "keep_alive": self.ollama_keep_alive,
+            "options": self._ollama_options()
+        }
+        return ProviderRequest(self.ollama_base, "/api/chat", {}, payload, NDJSONDecoder, _ollama_text, _ollama_usage)
 
-    def _openai_stream(self, messages: List[Dict]) -> Generator[str, None, None]:
+    def _openai_request(self, messages: List[Dict], summary: Optional[str] = None) -> ProviderRequest:
         if not self.openai_key:
             raise ValueError("OpenAI API key is missing. Set it in settings or environment.")
-        url = "https://api.openai.com/v1/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.openai_key}",
             "Content-Type": "application/json"
         }
         payload = {
             "model": self.online_model,
-            "messages": self._with_system(messages),
+            "messages": self._with_system(messages, summary),
             "temperature": self.temperature,
             "max_tokens": self.max_tokens,
             "stream": True
         }
-        with requests.post(url, headers=headers, json=payload, stream=True, timeout=600) as r:
-            r.raise_for_status()
-            for line in r.iter_lines(decode_unicode=True):
-                if not line or not line.startswith("data:"):
-                    continue
-                data_str = line.replace("data: ", "").strip()
-                if data_str == "[DONE]":
-                    break
-                try:
-                    data = json.loads(data_str)
-                except json.JSONDecodeError:
-                    continue
-                delta = data.get("choices", [{}])[0].get("delta", {})
-                piece = delta.get("content", "")
-                if piece:
-                    yield piece
+        return ProviderRequest(self.openai_base, "/v1/chat/completions", headers, payload, SSEDecoder, _openai_text)
 
-    def _anthropic_stream(self, messages: List[Dict]) -> Generator[str, None, None]:
+    def _anthropic_request(self, messages: List[Dict], summary: Optional[str] = None) -> ProviderRequest:
         if not self.anthropic_key:
             raise ValueError("Anthropic API key is missing. Set it in settings or environment.")
-        url = "https://api.anthropic.com/v1/messages"
         headers = {
             "x-api-key": self.anthropic_key,
             "anthropic-version": "2023-06-01",
             "content-type": "application/json"
         }
-        sys_prompt = None
+        system_parts = []
         user_turns = []
-        for m in messages:
+        for m in self._with_system(messages, summary):
             role = m.get("role")
             content = m.get("content", "")
             if role == "system":
-                sys_prompt = content
+                system_parts.append(content)
             elif role == "user":
                 user_turns.append({"role": "user", "content": content})
             elif role == "assistant":
                 user_turns.append({"role": "assistant", "content": content})
-
-        if sys_prompt is None:
-            sys_prompt = self.system_prompt
+        sys_prompt = "\n\n".join(system_parts)
 
         payload = {
             "model": self.anthropic_model,
@@ -119,27 +683,88 @@ class LLMClient:
             "stream": True,
             "messages": [{"role": u["role"], "content": u["content"]} for u in user_turns]
         }
+        return ProviderRequest(self.anthropic_base, "/v1/messages", headers, payload, SSEDecoder, _anthropic_text)
 
-        with requests.post(url, headers=headers, json=payload, stream=True, timeout=600) as r:
-            r.raise_for_status()
-            for raw in r.iter_lines(decode_unicode=True):
-                if not raw:
-                    continue
-                if not raw.startswith("data:"):
-                    continue
-                data_str = raw.replace("data:", "", 1).strip()
-                if data_str == "[DONE]":
-                    break
-                try:
-                    ev = json.loads(data_str)
-                except json.JSONDecodeError:
-                    continue
-                if ev.get("type") == "content_block_delta":
-                    delta = ev.get("delta", {})
-                    txt = delta.get("text", "")
-                    if txt:
-                        yield txt
-                elif "delta" in ev and isinstance(ev["delta"], dict):
-                    txt = ev["delta"].get("text", "")
-                    if txt:
-                        yield txt
+
+def _raise_errors(errors: Dict[str, Exception]):
+    # A single provider keeps its original exception; a failed chain reports
+    # every provider it tried.
+    if len(errors) == 1:
+        raise next(iter(errors.values()))
+    detail = "; ".join(f"{mode}: {e}" for mode, e in errors.items())
+    raise RuntimeError("No provider could answer. " + detail) from list(errors.values())[-1]
+
+
+def _finish(metrics: Optional[StreamMetrics], status: str):
+    if metrics is not None:
+        metrics.finish(status)
+
+
+def _replay(text: str, cancel: Optional[CancelToken] = None, chunk_size: int = 64) -> Generator[str, None, None]:
+    for i in range(0, len(text), chunk_size):
+        if cancel is not None and cancel.cancelled:
+            return
+        yield text[i:i + chunk_size]
+
+
+def _iter_bytes(r):
+    # Chunked responses (all three providers) are read chunk by chunk as they
+    # arrive; otherwise read small blocks so a stream without chunked
+    # encoding is not held back until a large buffer fills.
+    return r.iter_content(chunk_size=None if getattr(r.raw, "chunked", False) else 1024)
+
+
+def _texts(req: ProviderRequest, events: list):
+    # Text pieces in a batch of decoded events, and whether the stream ended.
+    pieces = []
+    extract = req.extract
+    for event in events:
+        if event is DONE:
+            return pieces, True
+        piece = extract(event)
+        if piece:
+            pieces.append(piece)
+    return pieces, False
+
+
+def _ollama_text(data) -> Optional[str]:
+    if not isinstance(data, dict):
+        return None
+    msg = data.get("message") or {}
+    return msg.get("content", "")
+
+
+def _ollama_usage(data, metrics: StreamMetrics):
+    # The final message (done: true) says where the time went: model load,
+    # prompt evaluation and generation, in nanoseconds, plus exact counts.
+    if not isinstance(data, dict) or not data.get("done"):
+        return
+    if data.get("eval_count"):
+        metrics.tokens = data["eval_count"]
+    metrics.prompt_tokens = data.get("prompt_eval_count")
+    metrics.load_ms = _ns_to_ms(data.get("load_duration"))
+    metrics.prompt_eval_ms = _ns_to_ms(data.get("prompt_eval_duration"))
+    metrics.eval_ms = _ns_to_ms(data.get("eval_duration"))
+
+
+def _ns_to_ms(value) -> Optional[float]:
+    return None if value is None else value / 1e6
+
+
+def _openai_text(data) -> Optional[str]:
+    if not isinstance(data, dict):
+        return None
+    choices = data.get("choices") or [{}]
+    delta = choices[0].get("delta") or {}
+    return delta.get("content", "")
+
+
+def _anthropic_text(ev) -> Optional[str]:
+    if not isinstance(ev, dict):
+        return None
+    if ev.get("type") == "content_block_delta":
+        delta = ev.get("delta", {})
+        return delta.get("text", "")
+    if "delta" in ev and isinstance(ev["delta"], dict):
+        return ev["delta"].get("text", "")
+    return None
@@ -1,10 +1,8 @@
 
 import sys
+import logging
 from pathlib import Path
 import json
-from PyQt6.QtWidgets import QApplication
-from gui import MainWindow
-from db import Database
 
 APP_DIR = Path(__file__).resolve().parent
 SETTINGS_PATH = APP_DIR / "settings.json"
@@ -17,11 +15,62 @@ DEFAULT_SETTINGS = {
     "online_model": "gpt-4o-mini",
     "anthropic_model": "claude-3-opus-20240229",
     "ollama_base_url": "http://localhost:11434",
+    "openai_base_url": "https://api.openai.com",
+    "anthropic_base_url": "https://api.anthropic.com",
     "openai_api_key": "",
     "anthropic_api_key": "",
     "temperature": 0.7,
     "system_prompt": "You are a helpful assistant.",
-    "max_tokens": 1024
+    "max_tokens": 1024,
+    "context_limit": 8192,
+    "context_limits": {},
+    "summarize": False,
+    "summary_keep_recent": 20,
+    "summary_batch": 40,
+    "summary_min_turns": 10,
+    "render_interval_ms": 16,
+    "cache_enabled": False,
+    "cache_path": "response_cache.db",
+    "cache_max_temperature": 0.0,
+    "cache_memory_entries": 256,
+    "cache_max_entries": 10000,
+    "cache_max_bytes": 67108864,
+    "cache_ttl_seconds": 604800,
+    "http_pool_size": 4,
+    "http_keep_alive": True,
+    "http_connect_timeout": 10,
+    "http_read_timeout": 600,
+    "provider_concurrency": {"offline": 1, "openai": 4, "anthropic": 4},
+    "failover_enabled": False,
+    "failover_chain": ["offline", "openai", "anthropic"],
+    "retry_attempts": 2,
+    "retry_backoff_base": 0.5,
+    "retry_backoff_max": 8.0,
+    "breaker_failure_threshold": 3,
+    "breaker_reset_seconds": 30.0,
+    "health_probe_timeout": 2.0,
+    "ollama_preload": True,
+    "ollama_keep_alive": "30m",
+    "ollama_options": {},
+    "ollama_warmup_timeout": 300,
+    "memory_enabled": False,
+    "embedding_model": "nomic-embed-text",
+    "memory_top_k": 4,
+    "memory_min_score": 0.5,
+    "memory_max_tokens": 512,
+    "memory_snippet_chars": 400,
+    "memory_min_chars": 20,
+    "memory_batch_size": 32,
+    "memory_ann": "auto",
+    "memory_ann_threshold": 100000,
+    "memory_ann_ef": 128,
+    "batch_rate_limits": {},
+    "server_host": "127.0.0.1",
+    "server_port": 8765,
+    "server_max_queue": 32,
+    "server_api_key": "",
+    "server_rate_limits": {},
+    "compare_targets": []
 }
 
 def ensure_settings():
@@ -29,14 +78,41 @@ def ensure_settings():
         with open(SETTINGS_PATH, "w") as f:
             json.dump(DEFAULT_SETTINGS, f, indent=2)
 
+def setup_logging():
+    logging.basicConfig(
+        filename=str(LOGS_DIR / "app.log"),
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
 def main():
+    setup_logging()
     ensure_settings()
-    db = Database()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Headless: no Qt import at all, so this also runs on servers
+        # without a display or PyQt6 installed.
+        import batch
+        sys.exit(batch.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import server
+        sys.exit(server.main(sys.argv[2:]))
+
+    # The window goes up before anything slow: MainWindow migrates the
+    # database on a worker thread and imports the provider stack on first use.
+    from PyQt6.QtWidgets import QApplication
     app = QApplication(sys.argv)
     app.setApplicationName("LocalAIApp")
-    window = MainWindow(db, str(SETTINGS_PATH))
+    app.aboutToQuit.connect(close_http_pools)
+    from gui import MainWindow
+    window = MainWindow(str(SETTINGS_PATH))
     window.show()
     sys.exit(app.exec())
 
+def close_http_pools():
+    # Only if a provider was used; importing http_pool here would pull in requests.
+    http_pool = sys.modules.get("http_pool")
+    if http_pool is not None:
+        http_pool.close_all()
+
 if __name__ == "__main__":
     main()
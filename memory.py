@@ -0,0 +1,416 @@
+import importlib.util
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import http_pool
+import router
+
+log = logging.getLogger("localai.memory")
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+
+class OllamaEmbedder:
+    def __init__(self, base_url: str, model: str, keep_alive="30m", timeout=(10, 120), pool_size: int = 4):
+        self.base_url = base_url
+        self.model = model
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.pool_size = pool_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        session = http_pool.get_session(self.base_url, self.pool_size)
+        payload = {"model": self.model, "input": texts, "truncate": True, "keep_alive": self.keep_alive}
+        with session.post(self.base_url + "/api/embed", json=payload, timeout=self.timeout) as r:
+            r.raise_for_status()
+            vectors = np.asarray(r.json()["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+class ExactIndex:
+    # Brute-force inner product over one contiguous float32 matrix; the whole
+    # scan is a single BLAS matrix-vector product. Capacity doubles as rows
+    # are added so incremental inserts stay amortised O(1).
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._sessions = np.empty(capacity, dtype=np.int32)
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def add(self, ids: np.ndarray, sessions: np.ndarray, vectors: np.ndarray):
+        n = len(ids)
+        if self._n + n > len(self._ids):
+            capacity = max(self._n + n, 2 * len(self._ids))
+            for name in ("_vectors", "_ids", "_sessions"):
+                old = getattr(self, name)
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self._n] = old[:self._n]
+                setattr(self, name, new)
+        self._vectors[self._n:self._n + n] = vectors
+        self._ids[self._n:self._n + n] = ids
+        self._sessions[self._n:self._n + n] = sessions
+        self._n += n
+
+    def search(self, query: np.ndarray, k: int, exclude_session: int = -1) -> Tuple[np.ndarray, np.ndarray]:
+        if self._n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # A float64 query would make NumPy upcast the whole matrix per call.
+        scores = self._vectors[:self._n] @ np.asarray(query, dtype=np.float32)
+        if exclude_session >= 0:
+            scores[self._sessions[:self._n] == exclude_session] = -np.inf
+        k = min(k, self._n)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        keep = np.isfinite(scores[top])
+        return self._ids[top][keep], scores[top][keep]
+
+    def rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._ids[:self._n], self._vectors[:self._n]
+
+
+class HNSWIndex:
+    # Approximate index for large histories; needs the optional hnswlib
+    # package. Labels are message ids, so no separate id mapping is kept.
+    def __init__(self, dim: int, capacity: int, m: int = 16, ef_construction: int = 200, ef: int = 128,
+                 path: Optional[str] = None):
+        import hnswlib
+
+        self.dim = dim
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        if path is not None:
+            self._index.load_index(path, max_elements=capacity)
+        else:
+            self._index.init_index(max_elements=capacity, M=m, ef_construction=ef_construction)
+        self._index.set_ef(ef)
+
+    def __len__(self) -> int:
+        return self._index.get_current_count()
+
+    def add(self, ids: np.ndarray, sessions: np.ndarray, vectors: np.ndarray):
+        needed = len(self) + len(ids)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        self._index.add_items(vectors, ids)
+
+    def search(self, query: np.ndarray, k: int, exclude_session: int = -1,
+               session_of: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        def keep(label):
+            return label >= len(session_of) or session_of[label] != exclude_session
+
+        filtered = exclude_session >= 0 and session_of is not None
+        while k > 0:
+            try:
+                labels, distances = self._index.knn_query(query, k=k, filter=keep if filtered else None)
+                return labels[0].astype(np.int64), 1.0 - distances[0]
+            except RuntimeError:
+                # Fewer than k candidates passed the filter.
+                k //= 2
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    def save(self, path: str):
+        self._index.save_index(path)
+
+
+# Embedding index over the messages table. Vectors live in an `embeddings`
+# table next to the messages (one float32 blob per message) and in an
+# in-memory index. A background thread loads the index, embeds messages
+# queued by Database.add_message, backfills older history and picks up
+# bulk-inserted rows when idle; search() is safe to call from any thread and
+# returns nothing until the index is loaded.
+class SemanticMemory:
+    def __init__(self, db, embedder: OllamaEmbedder, batch_size: int = 32, min_chars: int = 20,
+                 max_chars: int = 2000, ann: str = "auto", ann_threshold: int = 100000, ann_ef: int = 128,
+                 rescan_interval: float = 5.0):
+        self.db = db
+        self.db_path = db.path
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.ann = ann
+        self.ann_threshold = ann_threshold
+        self.ann_ef = ann_ef
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._session_codes: Dict[str, int] = {}
+        # Session code per message id (-1 = not indexed); also lets the
+        # indexer skip messages it has already embedded.
+        self._session_of = np.full(1024, -1, dtype=np.int32)
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self.ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="semantic-memory", daemon=True)
+        self._thread.start()
+
+    @property
+    def ann_path(self) -> str:
+        return f"{self.db_path}.{self.embedder.model.replace(':', '_').replace('/', '_')}.hnsw"
+
+    def __len__(self) -> int:
+        with self._lock:
+            return 0 if self._index is None else len(self._index)
+
+    def on_message(self, message_id: int, session_id: str, role: str, content: str):
+        # Database listener; runs on the writer's thread, so it only queues.
+        if len(content) >= self.min_chars:
+            self._queue.put((message_id, session_id, content))
+
+    def search(self, text: str, k: int = 4, exclude_session: Optional[str] = None,
+               min_score: float = 0.0) -> List[Dict]:
+        if not self.ready.is_set() or not text:
+            return []
+        query = self.embedder.embed([text[:self.max_chars]])[0]
+        ids, scores = self.search_vector(query, k, exclude_session)
+        hits = [(int(i), float(s)) for i, s in zip(ids, scores) if s >= min_score]
+        if not hits:
+            return []
+        marks = ",".join("?" for _ in hits)
+        with self.db.readers.connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, session_id, role, content, created_at FROM messages WHERE id IN ({marks})",
+                [i for i, _ in hits]
+            ).fetchall()
+        by_id = {r["id"]: dict(r) for r in rows}
+        return [dict(by_id[i], score=s) for i, s in hits if i in by_id]
+
+    def search_vector(self, query: np.ndarray, k: int, exclude_session: Optional[str] = None):
+        with self._lock:
+            if self._index is None:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            code = self._session_codes.get(exclude_session, -1) if exclude_session else -1
+            if isinstance(self._index, HNSWIndex):
+                return self._index.search(query, k, code, self._session_of)
+            return self._index.search(query, k, code)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            if isinstance(self._index, HNSWIndex):
+                # Saved so the next start can skip rebuilding the graph.
+                self._index.save(self.ann_path)
+
+    def _run(self):
+        try:
+            self._load()
+        except Exception:
+            log.exception("loading the embedding index failed")
+            return
+        finally:
+            self.ready.set()
+        # Rows written in bulk (Database.add_messages, imports) do not reach
+        # on_message, so whenever the queue is idle for rescan_interval the
+        # messages added since the last pass are scanned again.
+        after_id = 0
+        scan_to = self._max_id()
+        backfilling = True
+        first_pass = True
+        next_scan = 0.0
+        pending = []
+        attempt = 0
+        while not self._stop.is_set():
+            if not pending:
+                pending = self._drain(0 if backfilling else 0.5)
+            if not pending and not backfilling and time.monotonic() >= next_scan:
+                backfilling = True
+                scan_to = self._max_id()
+            if not pending and backfilling:
+                pending, after_id = self._unindexed(after_id)
+                backfilling = bool(pending)
+                if not backfilling:
+                    # Everything up to scan_to is indexed or too short.
+                    after_id = max(after_id, scan_to)
+                    next_scan = time.monotonic() + self.rescan_interval
+                    if first_pass:
+                        log.info("embedding backfill complete: %d messages indexed", len(self))
+                        first_pass = False
+            if not pending:
+                continue
+            try:
+                self._index_batch(pending)
+                pending = []
+                attempt = 0
+            except Exception as e:
+                # Usually Ollama not running or the model not pulled; keep the
+                # batch and retry later rather than dropping messages.
+                delay = router.backoff_delay(attempt, 1.0, 60.0)
+                attempt += 1
+                log.warning("embedding failed: %s; retrying in %.1fs", e, delay)
+                self._stop.wait(delay)
+
+    def _drain(self, timeout: float) -> List[Tuple[int, str, str]]:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _max_id(self) -> int:
+        with self.db.readers.connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def _unindexed(self, after_id: int):
+        with self.db.readers.connection() as conn:
+            rows = conn.execute(
+                "SELECT m.id, m.session_id, m.content FROM messages m "
+                "LEFT JOIN embeddings e ON e.message_id = m.id AND e.model = ? "
+                "WHERE m.id > ? AND e.message_id IS NULL AND length(m.content) >= ? ORDER BY m.id LIMIT ?",
+                (self.embedder.model, after_id, self.min_chars, self.batch_size)
+            ).fetchall()
+        return [tuple(r) for r in rows], (rows[-1][0] if rows else after_id)
+
+    def _index_batch(self, batch: List[Tuple[int, str, str]]):
+        batch = [b for b in batch if not self._is_indexed(b[0])]
+        if not batch:
+            return
+        vectors = self.embedder.embed([content[:self.max_chars] for _, _, content in batch])
+        ids = np.array([b[0] for b in batch], dtype=np.int64)
+        rows = [(int(i), self.embedder.model, vectors.shape[1], v.tobytes()) for i, v in zip(ids, vectors)]
+        self.db.write(_insert_embeddings, rows).result()
+        with self._lock:
+            self._add(ids, [b[1] for b in batch], vectors)
+        self._maybe_build_ann()
+
+    def _is_indexed(self, message_id: int) -> bool:
+        return message_id < len(self._session_of) and self._session_of[message_id] >= 0
+
+    def _add(self, ids: np.ndarray, session_ids: List[str], vectors: np.ndarray):
+        # Caller holds self._lock.
+        codes = np.array([self._session_codes.setdefault(s, len(self._session_codes)) for s in session_ids],
+                         dtype=np.int32)
+        top = int(ids.max()) + 1 if len(ids) else 0
+        if top > len(self._session_of):
+            grown = np.full(max(top, 2 * len(self._session_of)), -1, dtype=np.int32)
+            grown[:len(self._session_of)] = self._session_of
+            self._session_of = grown
+        self._session_of[ids] = codes
+        if self._index is None:
+            self._index = ExactIndex(vectors.shape[1])
+        self._index.add(ids, codes, vectors)
+
+    def _load(self):
+        model = self.embedder.model
+        with self.db.readers.connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+        if count and self._use_ann(count) and os.path.exists(self.ann_path) and self._load_ann(count):
+            return
+        with self.db.readers.connection() as conn:
+            cur = conn.execute(
+                "SELECT e.message_id, m.session_id, e.vector FROM embeddings e "
+                "JOIN messages m ON m.id = e.message_id WHERE e.model = ? ORDER BY e.message_id",
+                (model,)
+            )
+            while True:
+                rows = cur.fetchmany(20000)
+                if not rows:
+                    break
+                ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+                vectors = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+                with self._lock:
+                    self._add(ids, [r[1] for r in rows], vectors)
+        log.info("loaded %d embeddings (%s)", len(self), model)
+        self._maybe_build_ann()
+
+    def _load_ann(self, count: int) -> bool:
+        # Reuses the graph saved on the last clean exit when it still covers
+        # exactly the stored embeddings; only ids and sessions are read.
+        with self.db.readers.connection() as conn:
+            dim = conn.execute("SELECT dim FROM embeddings WHERE model = ? LIMIT 1",
+                                    (self.embedder.model,)).fetchone()[0]
+        try:
+            index = HNSWIndex(dim, count, ef=self.ann_ef, path=self.ann_path)
+        except Exception as e:
+            log.warning("could not load %s: %s", self.ann_path, e)
+            return False
+        if len(index) != count:
+            return False
+        with self.db.readers.connection() as conn:
+            cur = conn.execute(
+                "SELECT e.message_id, m.session_id FROM embeddings e "
+                "JOIN messages m ON m.id = e.message_id WHERE e.model = ?",
+                (self.embedder.model,)
+            )
+            rows = cur.fetchall()
+        with self._lock:
+            self._index = index
+            ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+            codes = np.array([self._session_codes.setdefault(r[1], len(self._session_codes)) for r in rows],
+                             dtype=np.int32)
+            self._session_of = np.full(max(1024, int(ids.max()) + 1 if len(ids) else 0), -1, dtype=np.int32)
+            self._session_of[ids] = codes
+        log.info("loaded approximate index with %d embeddings", count)
+        return True
+
+    def _use_ann(self, count: int) -> bool:
+        if self.ann == "exact":
+            return False
+        if self.ann == "auto" and count < self.ann_threshold:
+            return False
+        if importlib.util.find_spec("hnswlib") is None:
+            if self.ann == "hnsw":
+                log.warning("memory_ann is 'hnsw' but hnswlib is not installed; using exact search")
+            return False
+        return True
+
+    def _maybe_build_ann(self):
+        # Runs on the indexer thread, so no rows are added meanwhile. Exact
+        # search keeps serving while the graph is built; the swap frees the
+        # dense matrix.
+        with self._lock:
+            index = self._index
+        if not isinstance(index, ExactIndex) or not self._use_ann(len(index)):
+            return
+        ids, vectors = index.rows()
+        log.info("building approximate index over %d embeddings", len(ids))
+        ann = HNSWIndex(index.dim, len(ids), ef=self.ann_ef)
+        ann.add(ids, None, vectors)
+        with self._lock:
+            self._index = ann
+
+
+def _insert_embeddings(conn, rows):
+    # Runs on the Database's writer thread.
+    conn.executemany("INSERT OR REPLACE INTO embeddings (message_id, model, dim, vector) VALUES (?, ?, ?, ?)", rows)
+
+
+def get_memory(db, embedder: OllamaEmbedder, **config) -> SemanticMemory:
+    # One index per database file. It subscribes to the Database so new
+    # messages are embedded as they are written.
+    with _registry_lock:
+        memory = _registry.get(db.path)
+        if memory is None or memory.db is not db or memory.embedder.model != embedder.model:
+            if memory is not None:
+                memory.db.remove_listener(memory.on_message)
+                memory.close()
+            memory = SemanticMemory(db, embedder, **config)
+            _registry[db.path] = memory
+        db.add_listener(memory.on_message)
+        return memory
+
+
+def close_all():
+    with _registry_lock:
+        memories = list(_registry.values())
+        _registry.clear()
+    for memory in memories:
+        memory.close()
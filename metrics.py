@@ -0,0 +1,140 @@
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional
+
+log = logging.getLogger("localai.metrics")
+
+# Upper bounds (ms) of the inter-chunk latency histogram buckets; the last
+# bucket catches everything slower.
+GAP_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# Timings for one generation. The stream worker marks connect/chunk events
+# as they happen and the UI adds flush latencies; perf_counter is monotonic
+# across threads so both sides can share it.
+class StreamMetrics:
+    def __init__(self, provider: str, model: str, session_id: Optional[str] = None):
+        self.provider = provider
+        self.model = model
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.connected = None
+        self.first_chunk = None
+        self.last_chunk = None
+        self.finished = None
+        self.chunks = 0
+        self.chars = 0
+        self.tokens = None
+        # Server-side timings, reported by Ollama only.
+        self.prompt_tokens = None
+        self.load_ms = None
+        self.prompt_eval_ms = None
+        self.eval_ms = None
+        self.gap_histogram = [0] * (len(GAP_BUCKETS_MS) + 1)
+        self.flush_ms = []
+        self.cache_hit = False
+        self.status = "ok"
+
+    def mark_connected(self):
+        if self.connected is None:
+            self.connected = time.perf_counter()
+
+    def mark_chunk(self, text: str):
+        now = time.perf_counter()
+        if self.first_chunk is None:
+            self.first_chunk = now
+        else:
+            gap = (now - self.last_chunk) * 1000
+            bucket = len(GAP_BUCKETS_MS)
+            for i, bound in enumerate(GAP_BUCKETS_MS):
+                if gap <= bound:
+                    bucket = i
+                    break
+            self.gap_histogram[bucket] += 1
+        self.last_chunk = now
+        self.chunks += 1
+        self.chars += len(text)
+
+    def mark_flush(self, latency_s: float):
+        self.flush_ms.append(latency_s * 1000)
+
+    def finish(self, status: str = "ok"):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+            self.status = status
+
+    def _ms(self, end) -> Optional[float]:
+        return None if end is None else (end - self.started) * 1000
+
+    def token_count(self) -> int:
+        # Providers that report an exact count set self.tokens; otherwise use
+        # the same four-characters-per-token estimate as the context builder.
+        return self.tokens if self.tokens is not None else (self.chars + 3) // 4
+
+    def tokens_per_sec(self) -> Optional[float]:
+        if self.first_chunk is None or self.last_chunk is None or self.last_chunk <= self.first_chunk:
+            return None
+        return self.token_count() / (self.last_chunk - self.first_chunk)
+
+    def to_row(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "provider": self.provider,
+            "model": self.model,
+            "status": self.status,
+            "cache_hit": int(self.cache_hit),
+            "connect_ms": self._ms(self.connected),
+            "ttft_ms": self._ms(self.first_chunk),
+            "total_ms": self._ms(self.finished),
+            "chunks": self.chunks,
+            "tokens": self.token_count(),
+            "tokens_per_sec": self.tokens_per_sec(),
+            "gap_histogram": json.dumps(self.gap_histogram),
+            "ui_flush_p50_ms": percentile(self.flush_ms, 50),
+            "ui_flush_max_ms": max(self.flush_ms) if self.flush_ms else None,
+            "prompt_tokens": self.prompt_tokens,
+            "load_ms": self.load_ms,
+            "prompt_eval_ms": self.prompt_eval_ms,
+            "eval_ms": self.eval_ms,
+        }
+
+    def log(self):
+        row = self.to_row()
+        log.info(
+            "%s/%s status=%s cache=%s connect=%s ttft=%s total=%s tokens=%d tok/s=%s ui_flush_p50=%s "
+            "load=%s prompt_eval=%s eval=%s",
+            row["provider"], row["model"], row["status"], row["cache_hit"], _fmt(row["connect_ms"]),
+            _fmt(row["ttft_ms"]), _fmt(row["total_ms"]), row["tokens"], _fmt(row["tokens_per_sec"]),
+            _fmt(row["ui_flush_p50_ms"]), _fmt(row["load_ms"]), _fmt(row["prompt_eval_ms"]), _fmt(row["eval_ms"])
+        )
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def summarize_rows(rows: List[Dict]) -> List[Dict]:
+    # p50/p95/p99 per (provider, model) over metric rows from the database.
+    groups = {}
+    for r in rows:
+        groups.setdefault((r["provider"], r["model"]), []).append(r)
+    summary = []
+    for (provider, model), items in sorted(groups.items()):
+        entry = {"provider": provider, "model": model, "count": len(items)}
+        for field in ("connect_ms", "ttft_ms", "tokens_per_sec", "ui_flush_p50_ms", "total_ms",
+                      "load_ms", "prompt_eval_ms", "eval_ms"):
+            values = [r[field] for r in items if r[field] is not None]
+            for pct in (50, 95, 99):
+                entry[f"{field}_p{pct}"] = percentile(values, pct)
+        summary.append(entry)
+    return summary
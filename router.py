@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+
+log = logging.getLogger("localai.router")
+
+# Statuses worth retrying: timeouts, rate limits and server-side failures.
+# Anything else (bad key, bad request, unknown model) fails the same way on
+# every attempt, so the router moves on to the next provider instead.
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504, 529}
+
+# Cheap GET endpoints used to check whether a tripped provider is back.
+HEALTH_PATHS = {"offline": "/api/tags", "openai": "/v1/models", "anthropic": "/v1/models"}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def status_of(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "status", None)  # aiohttp.ClientResponseError
+    return status if isinstance(status, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    status = status_of(exc)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    # Connection refused/reset, timeouts and truncated bodies. ValueError
+    # (e.g. a missing API key) and malformed URLs are not transient.
+    try:
+        import requests
+        if isinstance(exc, requests.RequestException):
+            return isinstance(exc, (requests.ConnectionError, requests.Timeout,
+                                    requests.exceptions.ChunkedEncodingError))
+    except ImportError:
+        pass
+    try:
+        import aiohttp
+        if isinstance(exc, aiohttp.ClientError):
+            return isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+    except ImportError:
+        pass
+    return isinstance(exc, (OSError, TimeoutError, asyncio.TimeoutError))
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    # Seconds requested by a Retry-After header (delta or HTTP date), if any.
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random = random) -> float:
+    # Full jitter: uniform over [0, min(cap, base * 2^attempt)] so clients
+    # that failed together do not retry together.
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    # Closed: requests flow. After failure_threshold consecutive transient
+    # failures it opens and the provider is skipped. Once reset_seconds have
+    # passed the next caller runs a health probe; if it passes the breaker is
+    # half-open and lets one real request through to decide whether to close.
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self, probe: Optional[Callable[[], bool]] = None) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN or self._probing:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._probing = True
+        # The probe does network I/O, so it runs outside the lock; _probing
+        # keeps other callers from probing the same provider concurrently.
+        ok = True
+        try:
+            ok = probe() if probe is not None else True
+        except Exception:
+            ok = False
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._state = HALF_OPEN
+            else:
+                self._opened_at = time.monotonic()
+            return ok
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        # A half-open trial that ended without a verdict (e.g. cancelled by
+        # the user) hands the trial slot back instead of staying stuck.
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = OPEN
+                self._opened_at = time.monotonic() - self.reset_seconds
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def get_breaker(provider: str, base_url: str, failure_threshold: int = 3,
+                reset_seconds: float = 30.0) -> CircuitBreaker:
+    # Shared per provider endpoint, so every client and worker sees the same
+    # health state.
+    key = (provider, base_url)
+    with _lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(failure_threshold, reset_seconds)
+        else:
+            breaker.failure_threshold = failure_threshold
+            breaker.reset_seconds = reset_seconds
+        return breaker
+
+
+def reset_breakers():
+    with _lock:
+        _breakers.clear()
@@ -0,0 +1,141 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import http_pool
+
+DEFAULT_PROVIDER_LIMITS = {"offline": 1, "openai": 4, "anthropic": 4}
+
+# (client, messages, session_id)
+Job = Tuple[object, List[Dict], str]
+
+
+class QueueFull(Exception):
+    # Raised by GenerationScheduler.slot when too many callers are already
+    # waiting for a provider; servers turn it into a 429.
+    def __init__(self, provider: str):
+        super().__init__(f"too many requests queued for {provider}")
+        self.provider = provider
+
+
+class RateLimiter:
+    # Token bucket allowing `per_minute` requests per minute with bursts of
+    # up to `burst`. Only used from one event loop, so no lock is needed.
+    def __init__(self, per_minute: float, burst: Optional[int] = None):
+        self.rate = per_minute / 60.0
+        self.burst = burst or max(1, int(per_minute // 60) or 1)
+        self._tokens = float(self.burst)
+        self._updated = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._updated is not None:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Runs many LLMClient.astream_chat generations on one event loop, capping
+# how many are in flight against each provider at a time. Optional
+# per-provider rates (requests per minute) and a global cap on in-flight
+# generations bound bulk runs further. With max_queue set, at most that many
+# callers may wait for each provider; further ones fail fast with QueueFull
+# instead of piling up.
+class GenerationScheduler:
+    def __init__(self, limits: Optional[Dict[str, int]] = None, default_limit: int = 4,
+                 rates: Optional[Dict[str, float]] = None, max_in_flight: Optional[int] = None,
+                 max_queue: Optional[int] = None):
+        self.limits = dict(DEFAULT_PROVIDER_LIMITS)
+        self.limits.update(limits or {})
+        self.default_limit = default_limit
+        self.rates = dict(rates or {})
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._semaphores = {}
+        self._limiters = {}
+        self._waiting = {}
+        self._in_flight = None
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(provider)
+        if sem is None:
+            sem = asyncio.Semaphore(self.limits.get(provider, self.default_limit))
+            self._semaphores[provider] = sem
+        return sem
+
+    def _limiter(self, provider: str) -> Optional[RateLimiter]:
+        if not self.rates.get(provider):
+            return None
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limiter = self._limiters[provider] = RateLimiter(self.rates[provider])
+        return limiter
+
+    def queued(self, provider: str) -> int:
+        return self._waiting.get(provider, 0)
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        # Holds one generation slot for provider: global cap, provider
+        # concurrency and rate limit, in that order.
+        sem = self._semaphore(provider)
+        if self.max_queue is not None and sem.locked() and self.queued(provider) >= self.max_queue:
+            raise QueueFull(provider)
+        if self.max_in_flight is not None and self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._waiting[provider] = self.queued(provider) + 1
+        acquired = []
+        try:
+            for s in (self._in_flight, sem):
+                if s is not None:
+                    await s.acquire()
+                    acquired.append(s)
+            limiter = self._limiter(provider)
+            if limiter is not None:
+                await limiter.acquire()
+        except BaseException:
+            for s in acquired:
+                s.release()
+            raise
+        finally:
+            self._waiting[provider] -= 1
+        try:
+            yield
+        finally:
+            for s in acquired:
+                s.release()
+
+    async def run(self, client, messages: List[Dict], session_id: str,
+                  on_chunk: Optional[Callable[[str, str], None]] = None,
+                  on_start: Optional[Callable[[str], None]] = None, metrics=None) -> str:
+        # on_start fires once the generation has a slot, after any queueing.
+        async with self.slot(client.mode):
+            if on_start:
+                on_start(session_id)
+            parts = []
+            async for piece in client.astream_chat(messages, session_id, metrics=metrics):
+                parts.append(piece)
+                if on_chunk:
+                    on_chunk(session_id, piece)
+            return "".join(parts)
+
+    async def run_many(self, jobs: List[Job],
+                       on_chunk: Optional[Callable[[str, str], None]] = None) -> List:
+        tasks = [self.run(client, messages, session_id, on_chunk) for client, messages, session_id in jobs]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_sessions(jobs: List[Job], limits: Optional[Dict[str, int]] = None,
+                 on_chunk: Optional[Callable[[str, str], None]] = None) -> List:
+    async def _main():
+        try:
+            return await GenerationScheduler(limits).run_many(jobs, on_chunk)
+        finally:
+            await http_pool.aclose_all()
+
+    return asyncio.run(_main())
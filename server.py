@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+import http_pool
+from context import estimate_tokens
+from db import Database
+from llm_client import MODEL_SETTINGS, CancelToken, LLMClient, settings_with
+from metrics import StreamMetrics
+from scheduler import GenerationScheduler, QueueFull
+
+log = logging.getLogger("localai.server")
+
+# LLMClients kept for reuse, one per distinct model/temperature/max_tokens
+# combination; the least recently used is dropped beyond this.
+CLIENT_CACHE_SIZE = 32
+
+
+def _error(status: int, message: str, kind: str = "invalid_request_error", headers: Dict = None) -> web.Response:
+    return web.json_response({"error": {"message": message, "type": kind}}, status=status, headers=headers)
+
+
+def _messages(raw) -> Optional[List[Dict]]:
+    # OpenAI messages: content is a string or a list of parts, of which
+    # only the text parts are kept.
+    if not isinstance(raw, list) or not raw:
+        return None
+    messages = []
+    for m in raw:
+        if not isinstance(m, dict) or m.get("role") not in ("system", "user", "assistant"):
+            return None
+        content = m.get("content")
+        if isinstance(content, list):
+            content = "".join(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+        if not isinstance(content, str):
+            return None
+        messages.append({"role": m["role"], "content": content})
+    return messages
+
+
+def _sse(payload) -> bytes:
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+# OpenAI-compatible front end for the configured providers, so other tools
+# on the machine share the app's providers, response cache and history.
+# Requests are admitted through a GenerationScheduler: each provider runs
+# at most provider_concurrency generations, at most server_max_queue more
+# wait, and anything beyond that gets a 429 straight away. Streams are
+# written with await, so a slow reader slows its own upstream read rather
+# than buffering the whole answer in memory.
+class ChatServer:
+    def __init__(self, settings: Dict, db: Optional[Database]):
+        self.settings = settings
+        self.db = db
+        self.api_key = settings.get("server_api_key") or None
+        self.scheduler = GenerationScheduler(
+            settings.get("provider_concurrency"),
+            rates=settings.get("server_rate_limits"),
+            max_queue=settings.get("server_max_queue", 32),
+        )
+        self._clients = OrderedDict()
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._auth])
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    @web.middleware
+    async def _auth(self, request: web.Request, handler):
+        if self.api_key and request.path != "/health":
+            if request.headers.get("Authorization") != f"Bearer {self.api_key}":
+                return _error(401, "invalid API key", "authentication_error")
+        return await handler(request)
+
+    async def _cleanup(self, app):
+        await http_pool.aclose_all()
+
+    async def health(self, request: web.Request) -> web.Response:
+        queued = {p: self.scheduler.queued(p) for p in MODEL_SETTINGS}
+        return web.json_response({"status": "ok", "queued": queued})
+
+    async def models(self, request: web.Request) -> web.Response:
+        # Each provider is listed under its mode name and its configured model.
+        data = []
+        for mode, key in MODEL_SETTINGS.items():
+            for name in (mode, self.settings.get(key)):
+                if name:
+                    data.append({"id": name, "object": "model", "owned_by": mode})
+        return web.json_response({"object": "list", "data": data})
+
+    def client_for(self, body: Dict) -> LLMClient:
+        # "model" may name a mode ("offline", "openai", "anthropic") or one of
+        # the configured models; anything else is used as the model of the
+        # default mode.
+        model = body.get("model")
+        mode = None
+        if model in MODEL_SETTINGS:
+            mode, model = model, None
+        elif model:
+            mode = next((m for m, key in MODEL_SETTINGS.items() if self.settings.get(key) == model), None)
+        overrides = {
+            "mode": mode,
+            "model": model,
+            "temperature": body.get("temperature"),
+            "max_tokens": body.get("max_completion_tokens") or body.get("max_tokens"),
+        }
+        key = json.dumps(overrides, sort_keys=True)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = LLMClient(settings_with(self.settings, **overrides), self.db)
+            if len(self._clients) > CLIENT_CACHE_SIZE:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(key)
+        return client
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except ValueError:
+            return _error(400, "request body is not valid JSON")
+        messages = _messages(body.get("messages") if isinstance(body, dict) else None)
+        if messages is None:
+            return _error(400, "messages must be a non-empty list of {role, content}")
+        client = self.client_for(body)
+        session_id = request.headers.get("X-Session-Id") or str(uuid.uuid4())
+        try:
+            async with self.scheduler.slot(client.mode):
+                metrics = StreamMetrics(client.mode, client.model, session_id)
+                if body.get("stream"):
+                    return await self._stream(request, client, messages, session_id, metrics)
+                return await self._complete(client, messages, session_id, metrics)
+        except QueueFull as e:
+            return _error(429, str(e), "rate_limit_error", headers={"Retry-After": "1"})
+
+    async def _complete(self, client: LLMClient, messages: List[Dict], session_id: str,
+                        metrics: StreamMetrics) -> web.Response:
+        parts = []
+        try:
+            async for piece in client.astream_chat(messages, session_id, metrics=metrics):
+                metrics.mark_chunk(piece)
+                parts.append(piece)
+        except Exception as e:
+            metrics.finish("error")
+            self._record(session_id, messages, None, metrics)
+            return _error(502, f"{type(e).__name__}: {e}", "upstream_error")
+        metrics.finish("ok")
+        text = "".join(parts)
+        self._record(session_id, messages, text, metrics)
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = metrics.token_count()
+        return web.json_response({
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": metrics.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }, headers={"X-Session-Id": session_id})
+
+    async def _stream(self, request: web.Request, client: LLMClient, messages: List[Dict], session_id: str,
+                      metrics: StreamMetrics) -> web.StreamResponse:
+        cancel = CancelToken()
+        pieces = client.astream_chat(messages, session_id, cancel=cancel, metrics=metrics)
+        # Wait for the first piece before sending headers, so an upstream
+        # failure can still be reported with a proper status code.
+        try:
+            first = await pieces.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except Exception as e:
+            metrics.finish("error")
+            self._record(session_id, messages, None, metrics)
+            return _error(502, f"{type(e).__name__}: {e}", "upstream_error")
+
+        chunk_id = "chatcmpl-" + uuid.uuid4().hex
+        created = int(time.time())
+
+        def chunk(delta: Dict, finish: Optional[str] = None) -> bytes:
+            return _sse({
+                "id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": metrics.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            })
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Session-Id": session_id,
+        })
+        await response.prepare(request)
+        parts = []
+        status = "ok"
+        try:
+            await response.write(chunk({"role": "assistant", "content": ""}))
+            if first:
+                metrics.mark_chunk(first)
+                parts.append(first)
+                await response.write(chunk({"content": first}))
+            async for piece in pieces:
+                metrics.mark_chunk(piece)
+                parts.append(piece)
+                await response.write(chunk({"content": piece}))
+            await response.write(chunk({}, "stop"))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # The client went away; stop the upstream generation too.
+            status = "cancelled"
+            cancel.cancel()
+        except asyncio.CancelledError:
+            status = "cancelled"
+            cancel.cancel()
+            raise
+        except Exception as e:
+            status = "error"
+            log.warning("stream %s failed: %s", session_id, e)
+            await response.write(_sse({"error": {"message": f"{type(e).__name__}: {e}", "type": "upstream_error"}}))
+        finally:
+            await pieces.aclose()
+            metrics.finish(status)
+            self._record(session_id, messages, "".join(parts), metrics, truncated=status != "ok")
+        if status != "cancelled":
+            await response.write_eof()
+        return response
+
+    def _record(self, session_id: str, messages: List[Dict], text: Optional[str], metrics: StreamMetrics,
+                truncated: bool = False):
+        # A new session stores the whole conversation it was sent; a
+        # continued one (X-Session-Id) only the latest user turn. Both are
+        # queued to the writer thread, which decides inside the transaction,
+        # so the event loop never waits on the database.
+        if self.db is None:
+            return
+        self.db.add_metrics(metrics.to_row())
+        if text is None:
+            return
+        self.db.add_exchange(session_id, messages, text, truncated=truncated, model=metrics.model)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="main.py serve", description="OpenAI-compatible API for the configured providers")
+    parser.add_argument("--settings", type=Path, default=Path(__file__).resolve().parent / "settings.json")
+    parser.add_argument("--host", help="default: server_host setting, 127.0.0.1")
+    parser.add_argument("--port", type=int, help="default: server_port setting, 8765")
+    parser.add_argument("--db", default="chat_history.db", help="database to log sessions in")
+    parser.add_argument("--no-db", action="store_true", help="do not log sessions")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.settings.exists():
+        with open(args.settings) as f:
+            settings = json.load(f)
+    host = args.host or settings.get("server_host", "127.0.0.1")
+    port = args.port or settings.get("server_port", 8765)
+    db = None if args.no_db else Database(args.db)
+    app = ChatServer(settings, db).make_app()
+    print(f"Serving /v1/chat/completions on http://{host}:{port}", file=sys.stderr)
+    try:
+        web.run_app(app, host=host, port=port, access_log=None, print=None)
+    finally:
+        http_pool.close_all()
+        if db is not None:
+            # Semantic memory writes through the Database, so it stops first.
+            memory = sys.modules.get("memory")
+            if memory is not None:
+                memory.close_all()
+            db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import codecs
+import json
+
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+    loads = orjson.loads
+except ImportError:
+    JSON_BACKEND = "json"
+    loads = json.loads
+
+# Yielded by SSEDecoder for the OpenAI-style "data: [DONE]" sentinel.
+DONE = object()
+
+
+# Incremental decoders for the two streaming wire formats. Both take raw
+# bytes exactly as they come off the socket and split each network chunk
+# into lines in one C-level call, keeping only the trailing partial line.
+# orjson parses the byte slices directly. The stdlib json module is slow
+# on bytes (it sniffs the encoding per call), so without orjson each chunk
+# is decoded to str once and the same code runs on str.
+class _LineSplitter:
+    def __init__(self):
+        self._binary = loads is not json.loads
+        self._utf8 = None if self._binary else codecs.getincrementaldecoder("utf-8")(errors="replace")
+        empty = b"" if self._binary else ""
+        self._empty = empty
+        self._nl = b"\n" if self._binary else "\n"
+        self._cr = b"\r" if self._binary else "\r"
+        self._buf = empty
+
+    def _lines(self, data: bytes) -> list:
+        if self._utf8 is not None:
+            data = self._utf8.decode(data)
+        if self._buf:
+            data = self._buf + data
+        lines = data.split(self._nl)
+        self._buf = lines.pop()
+        return lines
+
+    def _rest(self):
+        if self._utf8 is not None:
+            self._buf += self._utf8.decode(b"", final=True)
+        rest, self._buf = self._buf, self._empty
+        return rest
+
+
+class NDJSONDecoder(_LineSplitter):
+    def feed(self, data: bytes) -> list:
+        out = []
+        for line in self._lines(data):
+            if line:
+                try:
+                    out.append(loads(line))
+                except ValueError:
+                    pass
+        return out
+
+    def close(self) -> list:
+        rest = self._rest()
+        if rest.strip():
+            try:
+                return [loads(rest)]
+            except ValueError:
+                pass
+        return []
+
+
+class SSEDecoder(_LineSplitter):
+    def __init__(self):
+        super().__init__()
+        self._data = []
+        self._field = b"data:" if self._binary else "data:"
+        self._space = b" " if self._binary else " "
+        self._done = b"[DONE]" if self._binary else "[DONE]"
+
+    def feed(self, data: bytes) -> list:
+        out = []
+        field = self._field
+        space = self._space
+        cr = self._cr
+        pending = self._data
+        for line in self._lines(data):
+            if line.endswith(cr):
+                line = line[:-1]
+            if not line:
+                # A blank line ends the event.
+                if not pending:
+                    continue
+                payload = pending[0] if len(pending) == 1 else self._nl.join(pending)
+                pending.clear()
+                if payload == self._done:
+                    out.append(DONE)
+                    continue
+                try:
+                    out.append(loads(payload))
+                except ValueError:
+                    pass
+            elif line.startswith(field):
+                payload = line[5:]
+                if payload.startswith(space):
+                    payload = payload[1:]
+                pending.append(payload)
+        return out
+
+    def close(self) -> list:
+        out = []
+        rest = self._rest().strip()
+        if rest.startswith(self._field):
+            self._data.append(rest[5:].strip())
+        if self._data:
+            self._dispatch(out)
+        return out
+
+    def _dispatch(self, out: list):
+        payload = self._data[0] if len(self._data) == 1 else self._nl.join(self._data)
+        self._data.clear()
+        if payload == self._done:
+            out.append(DONE)
+            return
+        try:
+            out.append(loads(payload))
+        except ValueError:
+            pass
@@ -0,0 +1,28 @@
+from typing import Dict, List, Optional
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a chat between a user and an assistant. "
+    "Merge the new turns into the existing summary. Keep facts, decisions, names, "
+    "open questions and user preferences; drop small talk. Reply with the updated "
+    "summary only, in at most a few short paragraphs."
+)
+
+
+def summary_messages(previous: Optional[str], turns: List[Dict]) -> List[Dict]:
+    lines = [f"{t['role'].upper()}: {t['content']}" for t in turns]
+    prompt = (
+        "Existing summary:\n" + (previous or "(none yet)") +
+        "\n\nNew turns:\n" + "\n\n".join(lines)
+    )
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def summarize(client, session_id: str, previous: Optional[str], turns: List[Dict]) -> str:
+    # Uses whichever provider the client is configured for, Ollama when offline.
+    parts = []
+    for piece in client.stream_chat(summary_messages(previous, turns), session_id=session_id):
+        parts.append(piece)
+    return "".join(parts).strip()